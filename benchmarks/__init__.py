@@ -0,0 +1,5 @@
+"""
+Benchmarks of the fdt package
+
+Usage: python3 -m benchmarks [-n NODES] [-o results.json] [-b baseline.json]
+"""
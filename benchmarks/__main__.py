@@ -0,0 +1,211 @@
+"""
+Time and peak memory of fdt operations on synthetic trees, compared with a stored baseline
+
+Usage: python3 -m benchmarks [-n NODES] [-p PROPS] [-d DEPTH] [-c CELLS] [-o results.json] [-b baseline.json]
+"""
+
+import gc
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fdt
+from benchmarks.trees import TreeScale, generate_tree, modify_tree, overlay_tree
+
+# Default allowed slowdown against baseline and allowed growth exponent (1.0 is linear)
+THRESHOLD = 0.25
+MAX_GROWTH = 1.5
+
+# Differences below these are noise, not regressions
+MIN_DELTA = {'seconds': 0.002, 'peak_bytes': 64 * 1024}
+
+
+def _search(fdt_obj: fdt.FDT):
+    fdt_obj.search('compatible', fdt.ItemType.PROP_STRINGS)
+    fdt_obj.search('status')
+    fdt_obj.search('', fdt.ItemType.NODE)
+    fdt_obj.search('reg', fdt.ItemType.PROP_WORDS, '/', False)
+
+
+def operations(scale: TreeScale) -> list:
+    """
+    Get benchmarked operations as list of (name, setup, run), run gets the value returned by setup
+
+    :param scale: The tree scale
+    """
+    base = generate_tree(scale)
+    dts = base.to_dts()
+    dtb = base.to_dtb()
+    changed_dtb = modify_tree(fdt.parse_dtb(dtb), 0.01).to_dtb()
+    overlay_dtb = overlay_tree(base, 0.05).to_dtb()
+    bare_dtb = generate_tree(scale, phandles=False).to_dtb()
+
+    return [
+        ('parse_dts', lambda: dts, fdt.parse_dts),
+        ('parse_dtb', lambda: dtb, fdt.parse_dtb),
+        ('to_dts', lambda: base, lambda obj: obj.to_dts()),
+        ('to_dtb', lambda: base, lambda obj: obj.to_dtb()),
+        ('diff', lambda: (fdt.parse_dtb(dtb), fdt.parse_dtb(changed_dtb)), lambda args: fdt.diff(*args)),
+        ('merge', lambda: (fdt.parse_dtb(dtb), fdt.parse_dtb(overlay_dtb)), lambda args: args[0].merge(args[1])),
+        ('search', lambda: fdt.parse_dtb(dtb), _search),
+        ('query', lambda: fdt.parse_dtb(dtb), lambda obj: list(obj.query('//i2c@*[status=okay]'))),
+        ('update_phandles', lambda: fdt.parse_dtb(bare_dtb), lambda obj: obj.update_phandles()),
+    ]
+
+
+def measure(setup, run, repeat: int) -> dict:
+    """
+    Get the best time of repeated runs and peak memory allocated by one run
+
+    :param setup: Function returning argument of run, not measured
+    :param run: The measured function
+    :param repeat: Count of timed runs
+    """
+    best = None
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            run(arg)
+            elapsed = time.perf_counter() - start
+        finally:
+            gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+        del arg
+
+    tracemalloc.start()
+    try:
+        arg = setup()
+        tracemalloc.reset_peak()
+        current = tracemalloc.get_traced_memory()[0]
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+
+    return {'seconds': best, 'peak_bytes': peak}
+
+
+def run_benchmarks(scale: TreeScale, repeat: int, names: list = None) -> dict:
+    """
+    Run benchmarks and return results as JSON serializable dict
+
+    :param scale: The tree scale
+    :param repeat: Count of timed runs of every operation
+    :param names: Names of operations to run, all if None
+    """
+    results = {}
+    for name, setup, run in operations(scale):
+        if names is None or name in names:
+            results[name] = measure(setup, run, repeat)
+    return {
+        'fdt_version': fdt.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'scale': scale.export(),
+        'results': results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> list:
+    """
+    Print results next to baseline and return list of regressions as (operation, metric, ratio)
+
+    :param report: Results of run_benchmarks()
+    :param baseline: Stored results of run_benchmarks()
+    :param threshold: Allowed relative increase of time and peak memory
+    """
+    if baseline is not None and baseline['scale'] != report['scale']:
+        raise Exception("Baseline scale {} differs from {}".format(baseline['scale'], report['scale']))
+
+    regressions = []
+    print(" {:<16}{:>12}{:>12}{:>9}{:>14}{:>9}".format('Operation', 'Time [s]', 'Baseline', 'Change', 'Peak [KiB]',
+                                                       'Change'))
+    for name, result in report['results'].items():
+        base = None if baseline is None else baseline['results'].get(name)
+        columns = [name, "{:.4f}".format(result['seconds']), '-', '-', str(result['peak_bytes'] // 1024), '-']
+        if base is not None:
+            columns[2] = "{:.4f}".format(base['seconds'])
+            for metric, column in (('seconds', 3), ('peak_bytes', 5)):
+                ratio = result[metric] / base[metric] if base[metric] else 1.0
+                columns[column] = "{:+.0%}".format(ratio - 1)
+                if ratio > 1 + threshold and result[metric] - base[metric] > MIN_DELTA[metric]:
+                    regressions.append((name, metric, ratio))
+        print(" {:<16}{:>12}{:>12}{:>9}{:>14}{:>9}".format(*columns))
+    return regressions
+
+
+def growth(report: dict, small: dict) -> dict:
+    """
+    Get growth exponent of time of every operation between two scales, 1.0 means linear and 2.0 quadratic
+
+    :param report: Results of run_benchmarks()
+    :param small: Results of run_benchmarks() with less nodes
+    """
+    factor = report['scale']['nodes'] / small['scale']['nodes']
+    exponents = {}
+    for name, result in report['results'].items():
+        base = small['results'].get(name)
+        if base is not None and base['seconds'] > 0 and result['seconds'] > 0:
+            exponents[name] = math.log(result['seconds'] / base['seconds']) / math.log(factor)
+    return exponents
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-n', '--nodes', type=int, default=10000, help="Count of nodes (default: 10000)")
+    parser.add_argument('-p', '--props', type=int, default=8, help="Properties per node (default: 8)")
+    parser.add_argument('-d', '--depth', type=int, default=6, help="Maximal node depth (default: 6)")
+    parser.add_argument('-c', '--cells', type=int, default=4, help="Length of cell arrays (default: 4)")
+    parser.add_argument('--seed', type=int, default=0, help="Random generator seed (default: 0)")
+    parser.add_argument('-r', '--repeat', type=int, default=3, help="Timed runs per operation (default: 3)")
+    parser.add_argument('-k', '--only', nargs='+', help="Run only listed operations")
+    parser.add_argument('-o', '--output', help="Save results into JSON file")
+    parser.add_argument('-b', '--baseline', help="Compare with results stored in JSON file")
+    parser.add_argument('-t', '--threshold', type=float, default=THRESHOLD,
+                        help="Allowed increase against baseline (default: {})".format(THRESHOLD))
+    parser.add_argument('-g', '--growth', action='store_true',
+                        help="Run also with 1/4 of nodes and check that time grows at most with exponent {}".format(
+                            MAX_GROWTH))
+    args = parser.parse_args()
+
+    scale = TreeScale(args.nodes, args.props, args.depth, args.cells, args.seed)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print("Synthetic tree: {}".format(scale))
+    report = run_benchmarks(scale, args.repeat, args.only)
+    regressions = compare(report, baseline, args.threshold)
+
+    if args.growth:
+        small_scale = TreeScale(max(1, args.nodes // 4), args.props, args.depth, args.cells, args.seed)
+        exponents = growth(report, run_benchmarks(small_scale, args.repeat, args.only))
+        report['growth'] = exponents
+        print(" Growth from {} nodes: {}".format(small_scale.nodes, ', '.join(
+            "{} {:.2f}".format(name, value) for name, value in exponents.items())))
+        regressions += [(name, 'growth', value) for name, value in exponents.items() if value > MAX_GROWTH]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(" Results saved as: {}".format(args.output))
+
+    for name, metric, value in regressions:
+        print(" REGRESSION {} {}: {:.2f}".format(name, metric, value), file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
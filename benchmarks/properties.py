@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Per-property cost of FDT property classification (fdt.misc.is_string and fdt.items.new_property)
+
+Usage: python3 benchmarks/properties.py path/to/board.dtb [-r REPEAT]
+"""
+
+import os
+import sys
+import argparse
+from timeit import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fdt
+from fdt.header import Header
+from fdt.items import new_property
+from fdt.misc import is_string
+
+
+def raw_properties(data: bytes) -> list:
+    """ Get (name, raw value) of all properties in binary blob """
+    view = memoryview(data)
+    entries = [fdt._scan_dtb_struct(view, Header.parse(data))]
+    values = []
+    while entries:
+        entry = entries.pop()
+        values += [(name, view[start:end]) for name, start, end in entry[1]]
+        entries += entry[2]
+    return values
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dtb', help="Path to binary blob")
+    parser.add_argument('-r', '--repeat', type=int, default=20, help="Repeat count (default: 20)")
+    args = parser.parse_args()
+
+    with open(args.dtb, 'rb') as f:
+        data = f.read()
+    values = raw_properties(data)
+    if not values:
+        raise SystemExit("No properties in {}".format(args.dtb))
+    count = len(values) * args.repeat
+
+    tests = (
+        ('is_string', lambda: [is_string(raw) for name, raw in values]),
+        ('new_property', lambda: [new_property(name, raw) for name, raw in values]),
+        ('parse_dtb', lambda: fdt.parse_dtb(data)),
+    )
+    print("{}: {} properties, {} bytes".format(args.dtb, len(values), len(data)))
+    for name, test in tests:
+        seconds = timeit(test, number=args.repeat)
+        print(" {:<14} {:10.1f} ns/property".format(name, seconds * 1e9 / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Synthetic device trees of configurable scale for benchmarks
+"""
+
+import random
+
+import fdt
+
+# Node kinds of SoC trees with their typical compatible strings
+NODE_KINDS = (
+    ('i2c', 'fsl,imx8mq-i2c'),
+    ('spi', 'fsl,imx8mq-ecspi'),
+    ('gpio', 'fsl,imx8mq-gpio'),
+    ('serial', 'fsl,imx8mq-uart'),
+    ('mmc', 'fsl,imx8mq-usdhc'),
+    ('usb', 'snps,dwc3'),
+    ('ethernet', 'fsl,imx8mq-fec'),
+    ('pinctrl', 'fsl,imx8mq-iomuxc'),
+    ('clock-controller', 'fsl,imx8mq-ccm'),
+    ('regulator', 'regulator-fixed'),
+)
+
+
+class TreeScale:
+    """ Scale of generated tree """
+
+    def __init__(self, nodes: int = 10000, props: int = 8, depth: int = 6, cells: int = 4, seed: int = 0):
+        """
+        TreeScale constructor
+
+        :param nodes: Count of nodes
+        :param props: Count of properties per node
+        :param depth: Maximal depth of nodes
+        :param cells: Length of cell arrays (reg and vendor properties)
+        :param seed: Random generator seed
+        """
+        assert nodes > 0 and props >= 0 and depth > 0 and cells > 0
+        self.nodes = nodes
+        self.props = props
+        self.depth = depth
+        self.cells = cells
+        self.seed = seed
+
+    def __str__(self):
+        return "{} nodes, {} props, depth {}, {} cells, seed {}".format(
+            self.nodes, self.props, self.depth, self.cells, self.seed)
+
+    def export(self) -> dict:
+        return dict(vars(self))
+
+
+def _node_props(rnd: random.Random, compatible: str, scale: TreeScale, phandles: list) -> list:
+    props = [
+        fdt.PropStrings('compatible', compatible, compatible.split(',')[-1]),
+        fdt.PropWords('reg', *[rnd.getrandbits(32) for _ in range(scale.cells)]),
+        fdt.PropStrings('status', rnd.choice(('okay', 'disabled'))),
+        fdt.PropWords('interrupts', 0, rnd.randrange(256), 4),
+    ]
+    if phandles:
+        props.append(fdt.PropWords('clocks', rnd.choice(phandles), rnd.randrange(64)))
+    index = 0
+    while len(props) < scale.props:
+        kind = index % 4
+        name = 'vendor,prop-{}'.format(index)
+        if kind == 0:
+            props.append(fdt.PropWords(name, *[rnd.getrandbits(32) for _ in range(scale.cells)]))
+        elif kind == 1:
+            props.append(fdt.PropStrings(name, 'value-{}'.format(rnd.randrange(1000))))
+        elif kind == 2:
+            props.append(fdt.PropBytes(name, data=bytes(rnd.getrandbits(8) for _ in range(scale.cells + 1))))
+        else:
+            props.append(fdt.Property(name))
+        index += 1
+    return props[:scale.props]
+
+
+def generate_tree(scale: TreeScale, phandles: bool = True) -> fdt.FDT:
+    """
+    Generate device tree, nodes are spread randomly over the levels up to scale.depth
+
+    :param scale: The tree scale
+    :param phandles: If False, nodes get no phandle properties (input of update_phandles)
+    """
+    rnd = random.Random(scale.seed)
+    fdt_obj = fdt.FDT()
+    fdt_obj.header.version = 17
+    root = fdt_obj.root
+    root.append(fdt.PropWords('#address-cells', 1))
+    root.append(fdt.PropWords('#size-cells', 1))
+    root.append(fdt.PropStrings('model', 'Synthetic Board ({})'.format(scale)))
+    root.append(fdt.PropStrings('compatible', 'vendor,synthetic-board'))
+
+    # (node, depth), a parent is chosen from all created nodes above the depth limit
+    parents = [(root, 0)]
+    values = []
+    for index in range(scale.nodes - 1):
+        parent, depth = parents[rnd.randrange(len(parents))]
+        kind, compatible = NODE_KINDS[rnd.randrange(len(NODE_KINDS))]
+        node = fdt.Node('{}@{:x}'.format(kind, index))
+        for prop in _node_props(rnd, compatible, scale, values):
+            node.append(prop)
+        if phandles and index % 4 == 0:
+            values.append(len(values) + 1)
+            node.append(fdt.PropWords('phandle', values[-1]))
+        parent.append(node)
+        if depth + 1 < scale.depth:
+            parents.append((node, depth + 1))
+
+    return fdt_obj
+
+
+def modify_tree(fdt_obj: fdt.FDT, ratio: float, seed: int = 1) -> fdt.FDT:
+    """
+    Change status of some nodes, remove some properties and add new nodes (in place)
+
+    :param fdt_obj: The tree from generate_tree()
+    :param ratio: Part of nodes to modify
+    :param seed: Random generator seed
+    """
+    rnd = random.Random(seed)
+    nodes = fdt_obj.search('', fdt.ItemType.NODE)[1:]
+    for node in rnd.sample(nodes, max(1, int(len(nodes) * ratio))):
+        action = rnd.randrange(3)
+        if action == 0:
+            node.set_property('status', 'okay' if node.get_property('status')[0] == 'disabled' else 'disabled')
+        elif action == 1:
+            node.remove_property('interrupts')
+        else:
+            node.append(fdt.Node('added@{:x}'.format(rnd.getrandbits(32)), fdt.PropStrings('status', 'okay')))
+    return fdt_obj
+
+
+def overlay_tree(fdt_obj: fdt.FDT, ratio: float, seed: int = 2) -> fdt.FDT:
+    """
+    Get overlay with the paths of some nodes of the tree, with changed and new properties
+
+    :param fdt_obj: The tree from generate_tree()
+    :param ratio: Part of nodes in overlay
+    :param seed: Random generator seed
+    """
+    rnd = random.Random(seed)
+    overlay = fdt.FDT()
+    overlay.header.version = 17
+    nodes = fdt_obj.search('', fdt.ItemType.NODE)[1:]
+    for node in rnd.sample(nodes, max(1, int(len(nodes) * ratio))):
+        path = node.node_path()
+        overlay.set_property('status', 'okay', path)
+        overlay.set_property('vendor,overlay', rnd.getrandbits(32), path)
+    return overlay
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+
+from toolchain import dtvCacheDir, getToolchain
+
+# Increment whenever the layout of cache entries changes
+CACHE_FORMAT = 2
+
+# Files with these dtc directives make dtc read files unknown to cpp, their output isn't cached
+DTC_FILE_DIRECTIVES = (b'/include/', b'/incbin/')
+
+def defaultCacheDir():
+    return os.path.join(dtvCacheDir(), 'annotated')
+
+def fileDigest(fileName):
+    with open(fileName, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=20).hexdigest()
+
+# Return paths which would shadow the included files if they were created.
+# A file found in some dir of its search path (dir of the including file, then
+# the include dirs) is missing in all dirs searched before it.
+def shadowingPaths(includes, searchDirs):
+
+    searchDirs = [os.path.realpath(searchDir) for searchDir in searchDirs]
+    paths = []
+    parents = []
+    for depth, path in includes:
+        del parents[depth:]
+        candidates = [os.path.dirname(parents[-1])] if parents else []
+        parents.append(path)
+
+        candidates += searchDirs
+        for index, candidate in enumerate(candidates):
+            if path.startswith(candidate + os.sep):
+                relPath = os.path.relpath(path, candidate)
+                paths += [os.path.join(previous, relPath) for previous in candidates[:index]
+                          if previous != candidate]
+                break
+
+    return list(dict.fromkeys(paths))
+
+# Annotated output of "cpp | dtc" with the list of files cpp read.
+# An entry is found by the command inputs (file, include dirs, options, tools)
+# and is valid only while every file read by cpp has the same content hash
+# and no new file shadows them in the include search path.
+class annotationCache(object):
+
+    EXT = '.json'
+
+    def __init__(self, cacheDir=None, maxSize=128 * 1024 * 1024):
+        self.cacheDir = cacheDir or defaultCacheDir()
+        self.maxSize = maxSize
+        os.makedirs(self.cacheDir, exist_ok=True)
+
+    def key(self, dtsFile, incIncludes, level, dtsShowDeletedSupport):
+        tools = getToolchain()
+        inputs = [CACHE_FORMAT, os.path.realpath(dtsFile), list(incIncludes), level, dtsShowDeletedSupport,
+                  tools['cpp'], tools['dtc']]
+        return hashlib.blake2b(json.dumps(inputs).encode('utf-8'), digest_size=20).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cacheDir, key + self.EXT)
+
+    # Return (lines, includes) or None if missing or any dependency changed
+    def load(self, key):
+        fileName = self.path(key)
+        try:
+            with open(fileName) as f:
+                entry = json.load(f)
+            for depFile, depDigest in entry['deps']:
+                if fileDigest(depFile) != depDigest:
+                    return None
+            for shadowingPath in entry['absent']:
+                if os.path.exists(shadowingPath):
+                    return None
+            lines = entry['output'].splitlines(True)
+            includes = [tuple(include) for include in entry['includes']]
+        except FileNotFoundError:
+            # no entry or a dependency was removed
+            return None
+        except (OSError, ValueError, TypeError, KeyError):
+            # damaged entry
+            self.remove(fileName)
+            return None
+
+        try:
+            os.utime(fileName)
+        except OSError:
+            pass
+
+        return lines, includes
+
+    # includes is a list of (depth, path) of files read by cpp, depth 0 is dtsFile.
+    # startTime is time.time_ns() before cpp was started.
+    # searchDirs are the include dirs in the order given to cpp.
+    def store(self, key, lines, includes, startTime, searchDirs):
+        try:
+            deps = []
+            for depFile in dict.fromkeys(path for _, path in includes):
+                # a file modified while cpp was running may not match the output
+                if os.stat(depFile).st_mtime_ns >= startTime:
+                    return
+                with open(depFile, 'rb') as f:
+                    data = f.read()
+                # dtc reads these files itself, they aren't in the cpp trace
+                if any(directive in data for directive in DTC_FILE_DIRECTIVES):
+                    return
+                deps.append([depFile, hashlib.blake2b(data, digest_size=20).hexdigest()])
+        except OSError:
+            return
+
+        absent = [path for path in shadowingPaths(includes, searchDirs) if not os.path.exists(path)]
+
+        data = json.dumps({'deps': deps, 'absent': absent, 'includes': includes, 'output': ''.join(lines)})
+        if len(data) > self.maxSize:
+            return
+
+        fileName = self.path(key)
+        tmpFileName = '{}.{}.tmp'.format(fileName, os.getpid())
+        try:
+            with open(tmpFileName, 'w') as f:
+                f.write(data)
+            os.replace(tmpFileName, fileName)
+        except OSError:
+            self.remove(tmpFileName)
+            return
+
+        self.evict()
+
+    # Remove the least recently used entries until the cache fits into size limit
+    def evict(self):
+        files = []
+        totalSize = 0
+        with os.scandir(self.cacheDir) as it:
+            for item in it:
+                if item.name.endswith(self.EXT) and item.is_file():
+                    stat = item.stat()
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+                    totalSize += stat.st_size
+
+        files.sort()
+        for _, size, fileName in files:
+            if totalSize <= self.maxSize:
+                break
+            self.remove(fileName)
+            totalSize -= size
+
+    @staticmethod
+    def remove(fileName):
+        try:
+            os.remove(fileName)
+        except OSError:
+            pass
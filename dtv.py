@@ -1,18 +1,18 @@
 #!/usr/bin/env python3
 
-import ast
-import configparser
 import hashlib
 import os
 import re
 import string
 import subprocess
-from subprocess import PIPE
 import sys
+import time
 
-from includetree import includeTree
-from helper import loadConfig, annotateDTS
+from includetree import includeTree, includeTreeFromTrace
+from helper import loadConfig, annotateDTSLines
 from merge import mergeDts
+from dtvconfig import config
+from toolchain import getToolchain
 
 from PyQt6.QtGui import QColor, QDesktopServices
 from PyQt6 import QtCore, QtGui, QtWidgets
@@ -23,119 +23,150 @@ import qdarktheme
 
 DELETED_TAG = "__[|>*DELETED*<|]__"
 
-def getTopLevelItem(trwDT):
-    return trwDT.topLevelItem(trwDT.topLevelItemCount()-1)
+# Stages of loading a DTS file shown in the progress bar
+LOAD_STAGES = ['preprocess', 'compile', 'parse', 'populate']
+LOAD_STAGE_LABELS = {
+    'preprocess': 'Preprocessing',
+    'compile': 'Compiling',
+    'parse': 'Parsing',
+    'populate': 'Populating',
+}
 
-def populateDTS(trwDT, trwIncludedFiles, filename):
+# Parsed rows are sent to the UI in chunks, the first ones as soon as possible
+CHUNK_ROWS = 2000
+CHUNK_SECONDS = 0.1
 
-    # Clear remnants from previously opened file
-    trwDT.clear()
-    trwIncludedFiles.expandAll()
+# Split each annotated line into the row data of the DTS view, no Qt objects are created here
+def parseDTSLines(lines):
 
-    with open (filename) as f:
+    colors = {}
 
-        # Read each line in the DTS file
-        lineNum = 1
-        for line in f:
+    # Read each line of the annotated DTS
+    lineNum = 1
+    for line in lines:
 
-            # Look for the code (part before the "/*" comment)
-            idx = line.rfind("/*")
+        # Look for the code (part before the "/*" comment)
+        idx = line.rfind("/*")
 
-            if idx < 0:
-                lineContents = line.strip()
-            else:
-                lineContents = line[:idx].rstrip()
-
-            if idx > 0:
-                # Now pick the comment part of the line
-                commentFileList = line[idx+2:].strip()[:-2]
-                # Remove false positive
-                if "<no-file>:<no-line>" in commentFileList:
-                    commentFileList = None
-            else:
+        if idx < 0:
+            lineContents = line.strip()
+        else:
+            lineContents = line[:idx].rstrip()
+
+        if idx > 0:
+            # Now pick the comment part of the line
+            commentFileList = line[idx+2:].strip()[:-2]
+            # Remove false positive
+            if "<no-file>:<no-line>" in commentFileList:
                 commentFileList = None
+        else:
+            commentFileList = None
+
+        # If found, then clean-up
+        if commentFileList:
+            # The last (rightmost) file in the comma-separted list of filename:lineno
+            # Line numbers are made-up of integers after a ":" colon.
+            listOfSourcefiles = list(map(lambda f: os.path.realpath(f.strip()), commentFileList.split(',')))
+            fileWithLineNums = listOfSourcefiles[-1]
+
+            if fileWithLineNums:
+                # Filename is the last (rightmost) word in a forward-slash-separetd path string
+                includedFilename = fileWithLineNums.split(':', 1)[0].split('/')[-1]
+        else:
+            fileWithLineNums = ''
+
+        if not fileWithLineNums:
+            includedFilename = ''
+
+            # skip empty line
+            if not (lineContents.lstrip()):
+                lineNum += 1
+                continue
+
+        # find deleted tag
+        isDeleted = DELETED_TAG in lineContents
+        if isDeleted:
+            # remove deleted tag and uncomment content
+            lineContents = lineContents.replace('/* ' + DELETED_TAG + ' */ ', '')
+            lineContents = re.sub('/\*(.*)?\*/\s*', r'\g<1>', lineContents, flags=re.S)
+
+        # Pick a different background color for each filename
+        if includedFilename:
+            if includedFilename not in colors:
+                colorHash = (int(hashlib.sha1(includedFilename.encode('utf-8')).hexdigest(), 16) % 16) * 4
+                colors[includedFilename] = (255-colorHash*2, 240, 192+colorHash)
+            bgColor = colors[includedFilename]
+        else:
+            bgColor = (255, 255, 255)
 
-            # If found, then clean-up
-            if commentFileList:
-                # The last (rightmost) file in the comma-separted list of filename:lineno
-                # Line numbers are made-up of integers after a ":" colon.
-                listOfSourcefiles = list(map(lambda f: os.path.realpath(f.strip()), commentFileList.split(',')))
-                fileWithLineNums = listOfSourcefiles[-1]
+        # Include parents
+        parents = []
+        if commentFileList:
+            # Skip add parents for close bracket of node
+            if not (isDeleted and "};" in lineContents.strip()):
+                for fileWithLineNums in listOfSourcefiles[-2::-1]:
+                    strippedLineNums = fileWithLineNums.split(':', 1)[0]
+                    parents.append((strippedLineNums.split('/')[-1], fileWithLineNums))
+            fileWithLineNums = listOfSourcefiles[-1]
 
-                if fileWithLineNums:
-                    # Filename is the last (rightmost) word in a forward-slash-separetd path string
-                    includedFilename = fileWithLineNums.split(':', 1)[0].split('/')[-1]
-            else:
-                fileWithLineNums = ''
+        yield (lineNum, lineContents, includedFilename, fileWithLineNums, bgColor, isDeleted, bool(commentFileList),
+               parents)
 
-            if not fileWithLineNums:
-                includedFilename = ''
+        lineNum += 1
 
-                # skip empty line
-                if not (lineContents.lstrip()):
-                    lineNum += 1
-                    continue
+def addDTSRows(trwDT, rows):
 
-            # find deleted tag
-            isDeleted = DELETED_TAG in lineContents
-            if isDeleted:
-                # remove deleted tag and uncomment content
-                lineContents = lineContents.replace('/* ' + DELETED_TAG + ' */ ', '')
-                lineContents = re.sub('/\*(.*)?\*/\s*', r'\g<1>', lineContents, flags=re.S)
+    items = []
+    for lineNum, lineContents, includedFilename, fileWithLineNums, bgColor, isDeleted, annotated, parents in rows:
 
-            # Add line to the list
-            rowItem = QtWidgets.QTreeWidgetItem([str(lineNum), lineContents, includedFilename, fileWithLineNums])
-            trwDT.addTopLevelItem(rowItem)
+        # Add line to the list
+        rowItem = QtWidgets.QTreeWidgetItem([str(lineNum), lineContents, includedFilename, fileWithLineNums])
+        rowItem.setBackground(1, QColor(*bgColor))
+        items.append(rowItem)
 
-            # Pick a different background color for each filename
-            if includedFilename:
-                colorHash = (int(hashlib.sha1(includedFilename.encode('utf-8')).hexdigest(), 16) % 16) * 4
-                prevColorHash = colorHash
-                bgColor = QColor(255-colorHash*2, 240, 192+colorHash)
-            else:
-                bgColor = QColor(255, 255, 255)
-
-            rowItem.setBackground(1, bgColor)
-
-            if isDeleted:
-                rowItem.setForeground(1, QColor(255, 0, 0))
-                f = rowItem.font(0)
-                f.setStrikeOut(True)
-                f.setBold(True)
-                rowItem.setFont(1, f)
-
-            # Include parents
-            if commentFileList:
-                # Skip add parents for close bracket of node
-                if not (isDeleted and "};" in lineContents.strip()):
-                    for fileWithLineNums in listOfSourcefiles[-2::-1]:
-                        strippedLineNums = fileWithLineNums.split(':', 1)[0]
-                        includedFilename = strippedLineNums.split('/')[-1]
-                        rowItem = QtWidgets.QTreeWidgetItem([str(lineNum), "", includedFilename, fileWithLineNums])
-                        trwDT.addTopLevelItem(rowItem)
-                        item = getTopLevelItem(trwDT)
-                        item.setForeground(0, QColor(255, 255, 255));
-            elif not isDeleted:
-                item = getTopLevelItem(trwDT)
-                item.setForeground(1, QColor(175, 175, 175))
-                f = item.font(0)
-                item.setFont(1, f)
-
-            lineNum += 1
-
-def populateIncludedFiles(trwIncludedFiles, dtsFile, inputIncludeDirs):
+        if isDeleted:
+            rowItem.setForeground(1, QColor(255, 0, 0))
+            f = rowItem.font(0)
+            f.setStrikeOut(True)
+            f.setBold(True)
+            rowItem.setFont(1, f)
+        elif not annotated:
+            rowItem.setForeground(1, QColor(175, 175, 175))
+            f = rowItem.font(0)
+            rowItem.setFont(1, f)
+
+        for parentFilename, parentFileWithLineNums in parents:
+            rowItem = QtWidgets.QTreeWidgetItem([str(lineNum), "", parentFilename, parentFileWithLineNums])
+            rowItem.setForeground(0, QColor(255, 255, 255))
+            items.append(rowItem)
+
+    # Adding many rows at once is much faster than one by one
+    trwDT.addTopLevelItems(items)
+
+def buildIncludeTree(dtsFile, inputIncludeDirs, includes=None):
+
+    if includes:
+        # exactly the files cpp read for dtc
+        return includeTreeFromTrace(includes)
+    return includeTree(dtsFile, inputIncludeDirs)
+
+def populateIncludedFiles(trwIncludedFiles, dtsIncludeTree):
 
     trwIncludedFiles.clear()
-    dtsIncludeTree = includeTree(dtsFile, inputIncludeDirs)
     dummyItem = QtWidgets.QTreeWidgetItem()
     dtsIncludeTree.populateChildrenFileNames(dummyItem)
     trwIncludedFiles.addTopLevelItem(dummyItem.child(0).clone())
+    trwIncludedFiles.expandAll()
 
 def highlightFileInTree(trwIncludedFiles, fileWithLineNums):
     filePath = fileWithLineNums.split(':', 1)[0]
     fileName = filePath.split('/')[-1]
     items = trwIncludedFiles.findItems(fileName, QtCore.Qt.MatchFlag.MatchRecursive)
-    currItem = next(item for item in items if item.toolTip(0) == filePath)
+    currItem = next((item for item in items if item.toolTip(0) == filePath), None)
+
+    # included files are shown when the whole DTS is loaded
+    if currItem is None:
+        return
 
     # highlight/select current item
     trwIncludedFiles.setCurrentItem(currItem)
@@ -187,12 +218,81 @@ def center(window):
     # Align current window as per above calculations
     window.move(frameGm.topLeft())
 
+# Run cpp and dtc and parse their output outside of the GUI thread
+class annotateWorker(QtCore.QThread):
+
+    stageChanged = QtCore.pyqtSignal(str)
+    rowsReady = QtCore.pyqtSignal(list)
+    includeTreeReady = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(str)
+
+    def __init__(self, fileName, incIncludes, parent=None):
+        super().__init__(parent)
+        self.fileName = fileName
+        self.incIncludes = incIncludes
+        self.processes = []
+
+    def killProcesses(self):
+        for proc in list(self.processes):
+            if proc.poll() is None:
+                proc.kill()
+
+    def cancel(self):
+        self.requestInterruption()
+
+        # unblock the worker waiting for dtc output
+        self.killProcesses()
+
+    def reportStage(self, stage):
+
+        # dtc can start after cancel() killed the processes known so far
+        if self.isInterruptionRequested():
+            self.killProcesses()
+        else:
+            self.stageChanged.emit(stage)
+
+    def run(self):
+        includes = []
+        rows = []
+        lastChunkTime = time.monotonic()
+
+        try:
+            lines = annotateDTSLines(self.fileName, self.incIncludes, includes=includes,
+                                     progress=self.reportStage, processes=self.processes)
+            try:
+                for row in parseDTSLines(lines):
+                    if self.isInterruptionRequested():
+                        return
+                    rows.append(row)
+                    if len(rows) >= CHUNK_ROWS or time.monotonic() - lastChunkTime >= CHUNK_SECONDS:
+                        self.rowsReady.emit(rows)
+                        rows = []
+                        lastChunkTime = time.monotonic()
+            finally:
+                lines.close()
+
+            self.rowsReady.emit(rows)
+            if self.isInterruptionRequested():
+                return
+
+            self.stageChanged.emit('populate')
+            self.includeTreeReady.emit(buildIncludeTree(self.fileName, self.incIncludes, includes))
+        except subprocess.CalledProcessError as e:
+            # killed processes fail too
+            if not self.isInterruptionRequested():
+                self.failed.emit('{}\n\n{}'.format(e, e.stderr.decode(sys.getfilesystemencoding(), 'replace')))
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class main(QMainWindow):
 
 
     def __init__(self):
         super().__init__()
         self.ui = None
+        self.worker = None
+        self.loadedRows = 0
+        self.loadingStage = -1
         self.load_ui()
         self.load_signals()
         self.findStr = None
@@ -228,33 +328,117 @@ class main(QMainWindow):
             self.foundList = []
             self.foundIndex = 0
 
-            annotatedTmpDTSFileName = None
+            # Only one file is loaded at a time
+            self.cancelLoading()
+            self.ui.trwDT.clear()
+            self.ui.trwIncludedFiles.clear()
+            self.ui.lblDT.setText('')
+
             try:
                 if baseDtsFileName:
                     incIncludes = loadConfig(baseDtsFileName)
                 else:
                     incIncludes = loadConfig(fileName)
-
-                # Resolve symlinks in path
-                fileName = os.path.realpath(fileName)
-                annotatedTmpDTSFileName = annotateDTS(fileName, incIncludes)
-                populateIncludedFiles(self.ui.trwIncludedFiles, fileName, incIncludes)
-                populateDTS(self.ui.trwDT, self.ui.trwIncludedFiles, annotatedTmpDTSFileName)
             except Exception as e:
                 print('EXCEPTION!', e)
-                exit(1)
-            finally:
-                # Delete temporary file if created
-                if annotatedTmpDTSFileName:
-                    try:
-                        os.remove(annotatedTmpDTSFileName)
-                    except OSError:
-                        pass
-
-            self.trwDT.header().setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
-            self.trwDT.header().setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
-            self.trwDT.header().setSectionHidden(3, True)
-            self.trwDT.header().resizeSection(1, 500)
+                self.showLoadingError(None, str(e))
+                return
+
+            # Resolve symlinks in path
+            fileName = os.path.realpath(fileName)
+
+            # dtc output is streamed into the tree in chunks,
+            # the include tree comes from the same cpp run (or the cache)
+            worker = annotateWorker(fileName, incIncludes, self)
+            worker.stageChanged.connect(lambda stage, w=worker: self.showLoadingStage(w, stage))
+            worker.rowsReady.connect(lambda rows, w=worker: self.addLoadedRows(w, rows))
+            worker.includeTreeReady.connect(lambda tree, w=worker: self.showIncludeTree(w, tree))
+            worker.failed.connect(lambda message, w=worker: self.showLoadingError(w, message))
+            worker.finished.connect(lambda w=worker: self.loadingFinished(w))
+            self.worker = worker
+            self.loadedRows = 0
+            self.loadingStage = -1
+
+            self.progressBar.setValue(0)
+            self.progressBar.setFormat('Starting...')
+            self.progressBar.show()
+            self.btnCancel.show()
+            worker.start()
+
+    def cancelLoading(self):
+
+        if self.worker is None:
+            return
+
+        worker = self.worker
+        self.worker = None
+        worker.cancel()
+        worker.wait()
+        self.progressBar.hide()
+        self.btnCancel.hide()
+
+    def showLoadingStage(self, worker, stage):
+
+        # Skip signals of a cancelled worker
+        if worker is not self.worker:
+            return
+
+        # Stage signals come from several threads, never go back
+        index = LOAD_STAGES.index(stage)
+        if index <= self.loadingStage:
+            return
+
+        self.loadingStage = index
+        self.progressBar.setValue(index)
+        self.progressBar.setFormat(LOAD_STAGE_LABELS[stage] + '...')
+
+    def addLoadedRows(self, worker, rows):
+
+        if worker is not self.worker:
+            return
+
+        addDTSRows(self.ui.trwDT, rows)
+        self.loadedRows += len(rows)
+        if self.loadingStage == LOAD_STAGES.index('parse'):
+            self.progressBar.setFormat('{}... {} lines'.format(LOAD_STAGE_LABELS['parse'], self.loadedRows))
+
+    def showIncludeTree(self, worker, dtsIncludeTree):
+
+        if worker is not self.worker:
+            return
+
+        populateIncludedFiles(self.ui.trwIncludedFiles, dtsIncludeTree)
+
+    def showLoadingError(self, worker, message):
+
+        if worker is not self.worker:
+            return
+
+        print('EXCEPTION!', message)
+        QMessageBox.critical(self,
+                             'DTV',
+                             'Failed to load DTS file!\n\n' + message,
+                             QMessageBox.StandardButton.Ok)
+
+    def loadingFinished(self, worker):
+
+        worker.deleteLater()
+        if worker is not self.worker:
+            return
+
+        self.worker = None
+        self.progressBar.setValue(len(LOAD_STAGES))
+        self.progressBar.hide()
+        self.btnCancel.hide()
+
+        self.trwDT.header().setSectionResizeMode(0, QHeaderView.ResizeMode.ResizeToContents)
+        self.trwDT.header().setSectionResizeMode(2, QHeaderView.ResizeMode.ResizeToContents)
+        self.trwDT.header().setSectionHidden(3, True)
+        self.trwDT.header().resizeSection(1, 500)
+
+    def closeEvent(self, event):
+        self.cancelLoading()
+        super().closeEvent(event)
 
     def highlightSourceFile(self):
 
@@ -274,12 +458,8 @@ class main(QMainWindow):
 
     def launchEditor(self, srcFileName, srcLineNum):
 
-        # Load configuration for the conf file
-        config = configparser.ConfigParser()
-        config.read('dtv.conf')
-
-        # Launch user-specified editor
-        editorCommand = ast.literal_eval(config.get('dtv', 'editor_cmd'))
+        # Launch user-specified editor, dtv.conf is read again only if changed
+        editorCommand = config.editorCommand()
         editorCommandEvaluated = string.Template(editorCommand).substitute(locals())
 
         try:
@@ -370,26 +550,32 @@ class main(QMainWindow):
 
         self.trwDT.setHeaderLabels(['Line No.', 'DTS content ....', 'Source File', 'Full path'])
 
+        # Loading progress, shown only while a file is loaded
+        self.progressBar = QtWidgets.QProgressBar()
+        self.progressBar.setRange(0, len(LOAD_STAGES))
+        self.progressBar.setTextVisible(True)
+        self.progressBar.hide()
+        self.btnCancel = QtWidgets.QPushButton('Cancel')
+        self.btnCancel.clicked.connect(self.cancelLoading)
+        self.btnCancel.hide()
+        self.statusBar().addPermanentWidget(self.progressBar)
+        self.statusBar().addPermanentWidget(self.btnCancel)
+
         self.center()
         self.show()
 
     def load_signals(self):
         pass
 
-try:
-    subprocess.run('which cpp dtc', stdout=PIPE, stderr=PIPE, shell=True, check=True)
-except subprocess.CalledProcessError as e:
-    print('EXCEPTION!', e)
-    print('stdout: {}'.format(e.output.decode(sys.getfilesystemencoding())))
-    print('stderr: {}'.format(e.stderr.decode(sys.getfilesystemencoding())))
-    exit(e.returncode)
-
-try:
-    subprocess.run('dtc --annotate -h', stdout=PIPE, stderr=PIPE, shell=True, check=True)
-except subprocess.CalledProcessError as e:
-    print('EXCEPTION!', e)
+tools = getToolchain()
+for tool in ('cpp', 'dtc'):
+    if not tools[tool]:
+        print('EXCEPTION!', '"{}" not found in PATH'.format(tool))
+        exit(1)
+
+if not tools['annotate']:
     print('EXCEPTION!', 'dtc version it too old and it doesn\'t support "annotate" option')
-    exit(e.returncode)
+    exit(1)
 
 app = QApplication(sys.argv)
 qdarktheme.setup_theme("light")
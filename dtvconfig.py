@@ -0,0 +1,84 @@
+import ast
+import configparser
+import os
+import re
+
+# dtv.conf is read once and again only when it changes on disk.
+# Existing include dirs are cached per kernel tree root (the path before "arch/").
+class configService(object):
+
+    def __init__(self, fileName='dtv.conf'):
+        self.fileName = fileName
+        self.signature = None
+        self.config = None
+        self.includeDirStubs = []
+        self.kernelRoots = {}
+        self.rootIncludeDirs = {}
+
+    def fileSignature(self):
+        try:
+            stat = os.stat(self.fileName)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    # Reload the conf file if it was changed, replaced or removed since the last call
+    def refresh(self):
+        signature = self.fileSignature()
+        if self.config is not None and signature == self.signature:
+            return
+
+        config = configparser.ConfigParser()
+        config.read(self.fileName)
+
+        # Add or remove projects from this list
+        # Only the gerrit-events of changes to projects in this list will be processed.
+        includeDirStubs = ast.literal_eval(config.get('dtv', 'include_dir_stubs'))
+
+        self.config = config
+        self.signature = signature
+        self.includeDirStubs = includeDirStubs
+        # resolved paths depend on the stubs
+        self.kernelRoots = {}
+        self.rootIncludeDirs = {}
+
+    def editorCommand(self):
+        self.refresh()
+        return ast.literal_eval(self.config.get('dtv', 'editor_cmd'))
+
+    def findKernelRoots(self, baseDtsFile):
+
+        baseAbsPath = os.path.abspath(baseDtsFile)
+        if baseAbsPath in self.kernelRoots:
+            return self.kernelRoots[baseAbsPath]
+
+        baseRealPath = os.path.realpath(baseDtsFile)
+
+        baseDirPaths = []
+        for basePath in (baseAbsPath, baseRealPath):
+            result = re.search('^.*(?=arch\/)', basePath)
+            if result and result.group(0) not in baseDirPaths:
+                baseDirPaths.append(result.group(0))
+
+        self.kernelRoots[baseAbsPath] = baseDirPaths
+        return baseDirPaths
+
+    def includeDirs(self, baseDtsFile):
+        self.refresh()
+
+        incIncludes = list()
+
+        baseDirPaths = self.findKernelRoots(baseDtsFile)
+        for includeDirStub in self.includeDirStubs:
+            for baseDirPath in baseDirPaths:
+                includeDir = baseDirPath + includeDirStub
+                # only found dirs are cached, a missing one can be created by a build or checkout
+                if (baseDirPath, includeDirStub) not in self.rootIncludeDirs:
+                    if not os.path.exists(includeDir):
+                        continue
+                    self.rootIncludeDirs[(baseDirPath, includeDirStub)] = includeDir
+                incIncludes.append(includeDir)
+
+        return incIncludes
+
+config = configService()
@@ -13,10 +13,16 @@
 # limitations under the License.
 
 import os
+from mmap import mmap
+from bisect import bisect_left
+from heapq import merge as merge_sorted
 
 from .header import Header, DTB_BEGIN_NODE, DTB_END_NODE, DTB_PROP, DTB_END, DTB_NOP
-from .items import new_property, Property, PropBytes, PropWords, PropStrings, PropVariables, PropIncBin, Node
-from .misc import strip_comments, split_to_lines, get_version_info, extract_string
+from .items import new_property, tree_generation, item_generation, phandle_generation, phandle_changes, \
+                   Property, PropBytes, PropWords, PropStrings, PropVariables, PropIncBin, Node, LazyNode, DtbWriter, \
+                   PHANDLE_PROPS
+from .query import compile_query
+from .misc import tokenize_dts, tokenize_dts_value, extract_string
 
 __author__  = "Martin Olejar"
 __contact__ = "martin.olejar@gmail.com"
@@ -37,6 +43,7 @@ __all__     = [
     # core methods
     'parse_dts',
     'parse_dtb',
+    'scan_dtb',
     'diff'
 ]
 
@@ -53,6 +60,99 @@ class ItemType:
     ALL = 100
 
 
+class SearchIndex:
+    """Name and type index of all items in tree, items are kept in the order of FDT.search()"""
+
+    def __init__(self, root: Node):
+        """
+        SearchIndex constructor
+
+        :param root: The root node
+        """
+        # id(node) -> (position, end of properties, end of subtree)
+        self.spans = {}
+        # (name, kind) -> positions, items; kind is Node or property class
+        self.names = {}
+        # kind -> positions, items
+        self.kinds = {}
+        # distinct names of nodes
+        self.node_names = []
+
+        position = 0
+        all_nodes = [root] if root is not None else []
+        starts = []
+        while all_nodes:
+            node = all_nodes.pop()
+            if node is None:
+                # all subnodes of the node on top of starts were visited
+                start_node, start, props_end = starts.pop()
+                self.spans[id(start_node)] = (start, props_end, position)
+                continue
+            start = position
+            self._add(node, Node, position)
+            position += 1
+            for prop in node.props:
+                self._add(prop, type(prop), position)
+                position += 1
+            starts.append((node, start, position))
+            all_nodes.append(None)
+            all_nodes += node.nodes
+        self.node_names = [name for name, kind in self.names if kind is Node]
+
+    def _add(self, item, kind, position: int):
+        for key, table in (((item.name, kind), self.names), (kind, self.kinds)):
+            entry = table.get(key)
+            if entry is None:
+                entry = table[key] = ([], [])
+            entry[0].append(position)
+            entry[1].append(item)
+
+    def find(self, node: Node, name: str, kinds, recursive: bool = True) -> list:
+        """
+        Get items of given kinds in node (and its subnodes)
+
+        :param node: The node object in indexed tree
+        :param name: Item name, all items if empty
+        :param kinds: Node and/or property classes, None for all property classes
+        :param recursive: Search in all sub-nodes
+        """
+        start, props_end, end = self.spans[id(node)]
+        if not recursive:
+            end = props_end
+        if kinds is None:
+            kinds = [Node] + [kind for kind in self.kinds if kind is not Node]
+        elif None in kinds:
+            kinds = [kind for kind in kinds if kind is not None] + [kind for kind in self.kinds if kind is not Node]
+        return self._collect([self.names.get((name, kind)) if name else self.kinds.get(kind) for kind in kinds],
+                             start, end)
+
+    def find_nodes(self, node: Node, names) -> list:
+        """
+        Get sub-nodes at any depth of node with one of given names
+
+        :param node: The node object in indexed tree
+        :param names: Node names
+        """
+        start, _, end = self.spans[id(node)]
+        return self._collect([self.names.get((name, Node)) for name in names], start + 1, end)
+
+    @staticmethod
+    def _collect(entries: list, start: int, end: int) -> list:
+        slices = []
+        for entry in entries:
+            if entry is None:
+                continue
+            first = bisect_left(entry[0], start)
+            last = bisect_left(entry[0], end, first)
+            if first < last:
+                slices.append((entry[0][first:last], entry[1][first:last]))
+        if not slices:
+            return []
+        if len(slices) == 1:
+            return slices[0][1]
+        return [item for _, item in merge_sorted(*[zip(*data) for data in slices], key=lambda pair: pair[0])]
+
+
 class FDT:
     """ Flattened Device Tree Class """
 
@@ -69,6 +169,21 @@ class FDT:
         self.entries = []
         self.header = Header() if header is None else header
         self.root = Node('/')
+        # path -> node index, filled on lookup and dropped when nodes are renamed, moved or removed
+        self._index = {}
+        self._index_root = None
+        self._index_generation = -1
+        # label -> node map filled by parser, phandle -> node index updated from the log of phandle changes
+        self._labels = {}
+        self._phandles = {}
+        self._max_phandle = 0
+        self._phandles_root = None
+        self._phandles_generation = None
+        # name and type index for search(), rebuilt on lookup when items of this tree have changed
+        self.search_index = True
+        self._search_index = None
+        self._search_root = None
+        self._search_generation = None
 
     def __str__(self):
         """ String representation """
@@ -90,22 +205,162 @@ class FDT:
         """
         assert isinstance(path, str), "Node path must be a string type !"
 
+        if self._index_root is not self.root or self._index_generation != tree_generation():
+            self._index = {}
+            self._index_root = self.root
+            self._index_generation = tree_generation()
+
+        node = self._index.get(path)
+        if node is not None:
+            return node
+
         node = self.root
-        path = path.lstrip('/')
-        if path:
-            names = path.split('/')
-            for name in names:
+        names = path.lstrip('/')
+        if names:
+            for name in names.split('/'):
                 item = node.get_subnode(name)
                 if item is None:
                     if create:
                         item = Node(name)
                         node.append(item)
                     else:
-                        raise ValueError("Path \"{}\" doesn't exists".format(path))
+                        raise ValueError("Path \"{}\" doesn't exists".format(names))
                 node = item
 
+        self._index[path] = node
+        return node
+
+    def _contains(self, node: Node) -> bool:
+        while node.parent is not None:
+            if node.parent.get_subnode(node.name) is not node:
+                return False
+            node = node.parent
+        return node is self.root
+
+    def get_node_by_label(self, label: str):
+        """
+        Get node object by its label, return None if the label doesn't exist
+
+        :param label: Label name
+        """
+        node = self._labels.get(label)
+        if node is None or not self._contains(node):
+            return None
+        return node
+
+    def set_label(self, label: str, path: str):
+        """
+        Assign label to node at specified path
+
+        :param label: Label name
+        :param path: Path to node
+        """
+        self._labels[label] = self.get_node(path)
+
+    def get_node_by_phandle(self, value: int):
+        """
+        Get node object by its phandle value, return None if not found
+
+        :param value: The phandle value
+        """
+        self._sync_phandles()
+        node = self._phandles.get(value)
+        if node is not None and not self._valid_phandle(node, value):
+            # the node was removed or its phandle changed, other node can have the value
+            self._scan_phandles()
+            node = self._phandles.get(value)
         return node
 
+    def get_phandle(self, path: str, create: bool = False):
+        """
+        Get phandle value of node at specified path, return None if the node has no phandle
+
+        :param path: Path to node
+        :param create: If True, a new phandle is assigned to node without it
+        """
+        return self._node_phandle(self.get_node(path), create)
+
+    def _node_phandle(self, node: Node, create: bool = False, linux_phandle: bool = True):
+        value = _phandle_value(node)
+        if value is None and create:
+            self._sync_phandles()
+            value = self._add_phandle(node, linux_phandle)
+        return value
+
+    def _valid_phandle(self, node: Node, value: int) -> bool:
+        return _phandle_value(node) == value and self._contains(node)
+
+    def _index_phandle(self, node: Node):
+        """ Add node with phandle into index, the first valid node with the value stays """
+        value = _phandle_value(node)
+        if value is None:
+            return
+        indexed = self._phandles.get(value)
+        if indexed is None or indexed is node or not self._valid_phandle(indexed, value):
+            self._phandles[value] = node
+        if self._max_phandle < value:
+            self._max_phandle = value
+
+    def _sync_phandles(self):
+        """ Update phandle index with the logged changes, rebuild it if they are not available """
+        changes = None
+        if self._phandles_root is self.root and self._phandles_generation is not None:
+            changes = phandle_changes(self._phandles_generation)
+        if changes is None:
+            self._scan_phandles()
+            return
+        for node, subtree in changes:
+            # the log is shared by all trees
+            if not self._contains(node):
+                continue
+            nodes = [node]
+            while nodes:
+                node = nodes.pop()
+                if subtree:
+                    nodes += node.nodes
+                self._index_phandle(node)
+        self._phandles_generation = phandle_generation()
+
+    def _scan_phandles(self) -> list:
+        """ Rebuild phandle index and return nodes without phandle in the walk order """
+        self._phandles = {}
+        self._max_phandle = 0
+        no_phandle_nodes = []
+        all_nodes = [self.root] if self.root is not None else []
+        while all_nodes:
+            node = all_nodes.pop()
+            all_nodes += node.nodes
+            value = _phandle_value(node)
+            if value is None:
+                no_phandle_nodes.append(node)
+            else:
+                self._phandles.setdefault(value, node)
+                if self._max_phandle < value:
+                    self._max_phandle = value
+        self._phandles_root = self.root
+        self._phandles_generation = phandle_generation()
+        return no_phandle_nodes
+
+    def _seed_phandles(self, nodes: list):
+        """ Build phandle index of new tree from the nodes with phandle properties """
+        self._phandles = {}
+        self._max_phandle = 0
+        for node in nodes:
+            self._index_phandle(node)
+        self._phandles_root = self.root
+        self._phandles_generation = phandle_generation()
+
+    def _add_phandle(self, node: Node, linux_phandle: bool = True) -> int:
+        """ Assign next free phandle to node, the index must be up to date """
+        value = self._max_phandle + 1
+        if linux_phandle:
+            node.set_property('linux,phandle', value)
+        node.set_property('phandle', value)
+        self._phandles[value] = node
+        self._max_phandle = value
+        self._phandles_generation = phandle_generation()
+        return value
+
     def get_property(self, name: str, path: str = '') -> Property:
         """ 
         Get property object by name from specified path
@@ -189,14 +444,28 @@ class FDT:
         assert isinstance(name, str), "Property name must be a string type !"
 
         node = self.get_node(path)
-        nodes = []
-        items = []
         pclss = {
             ItemType.PROP_BASE: Property,
             ItemType.PROP_BYTES: PropBytes,
             ItemType.PROP_WORDS: PropWords,
             ItemType.PROP_STRINGS: PropStrings
         }
+
+        index = self.get_search_index()
+        if index is not None:
+            if itype == ItemType.NODE:
+                kinds = [Node]
+            elif itype == ItemType.ALL:
+                kinds = None
+            elif itype in pclss:
+                kinds = [pclss[itype]]
+            else:
+                # all properties
+                kinds = [None]
+            return index.find(node, name, kinds, recursive)
+
+        nodes = []
+        items = []
         while True:
             nodes += node.nodes
             if itype == ItemType.NODE or itype == ItemType.ALL:
@@ -215,6 +484,33 @@ class FDT:
 
         return items
 
+    def get_search_index(self, build: bool = True):
+        """
+        Get up to date search index or None if search_index is disabled
+
+        :param build: If False, return None instead of building a new index
+        """
+        if not self.search_index:
+            return None
+        if self._search_root is not self.root or self._search_generation != item_generation(self.root):
+            if not build:
+                return None
+            self._search_index = SearchIndex(self.root)
+            self._search_root = self.root
+            self._search_generation = item_generation(self.root)
+        return self._search_index
+
+    def query(self, pattern, path: str = ''):
+        """
+        Yield nodes matching path pattern, e.g. "/soc/*/i2c@*" or "//pinctrl*[compatible~=fsl]"
+
+        :param pattern: Path pattern (see fdt.query) or compiled Query object
+        :param path: Path of the node the pattern is relative to (default: root)
+        """
+        if isinstance(pattern, str):
+            pattern = compile_query(pattern)
+        return pattern.run(self, path)
+
     def walk(self, path: str = '', relative: bool = False) -> list:
         """ 
         Walk trough nodes and return relative/absolute path with list of sub-nodes and properties
@@ -227,9 +523,7 @@ class FDT:
         node = self.get_node(path)
         while True:
             all_nodes += node.nodes
-            current_path = "{}/{}".format(node.path, node.name)
-            current_path = current_path.replace('///', '/')
-            current_path = current_path.replace('//', '/')
+            current_path = node.node_path() or '/'
             if path and relative:
                 current_path = current_path.replace(path, '').lstrip('/')
             yield current_path, node.nodes, node.props
@@ -237,12 +531,13 @@ class FDT:
                 break
             node = all_nodes.pop()
 
-    def merge(self, fdt_obj, replace: bool = True):
+    def merge(self, fdt_obj, replace: bool = True, move: bool = False):
         """
         Merge external FDT object into this object.
         
         :param fdt_obj: The FDT object which will be merged into this
         :param replace: True for replace existing items or False for keep old items
+        :param move: True for moving nodes and properties of fdt_obj instead of copying, fdt_obj is unusable after
         """
         assert isinstance(fdt_obj, FDT)
         if self.header.version is None:
@@ -262,41 +557,29 @@ class FDT:
                 if not exist:
                     self.entries.append(in_entry)
 
-        self.root.merge(fdt_obj.get_node('/'), replace)
+        labels = {label: node.node_path() or '/'
+                  for label, node in fdt_obj._labels.items() if fdt_obj._contains(node)}
+        self.root.merge(fdt_obj.get_node('/'), replace, move)
+        for label, path in labels.items():
+            self._labels[label] = self.get_node(path)
 
     def update_phandles(self):
-        all_nodes = []
-        phandle_value = 0
-        no_phandle_nodes = []
-
-        node = self.root
-        all_nodes += self.root.nodes
-        while all_nodes:
-            props = (node.get_property('phandle'), node.get_property('linux,phandle'))
-            value = None
-            for i, p in enumerate(props):
-                if isinstance(p, PropWords) and isinstance(p.value, int):
-                    value = None if i == 1 and p.value != value else p.value
-            if value is None:
-                no_phandle_nodes.append(node)
-            elif phandle_value < value:
-                phandle_value = value
-            # ...
-            node = all_nodes.pop()
-            all_nodes += node.nodes
-
-        if phandle_value > 0:
-            phandle_value += 1
-
-        for node in no_phandle_nodes:
-            node.set_property('linux,phandle', phandle_value)
-            node.set_property('phandle', phandle_value)
-            phandle_value += 1
+        """ Assign phandle to all nodes without it, the values continue from the highest used one """
+        for node in self._scan_phandles():
+            self._add_phandle(node)
 
     def to_dts(self, tabsize: int = 4) -> str:
         """
         Store FDT Object into string format (DTS)
 
+        :param tabsize:
+        """
+        return ''.join(self.iter_dts(tabsize))
+
+    def iter_dts(self, tabsize: int = 4):
+        """
+        Generate FDT Object in string format (DTS) chunk by chunk
+
         :param tabsize:
         """
         result = "/dts-v1/;\n"
@@ -312,9 +595,18 @@ class FDT:
                 result += "{:#x} ".format(entry['address']) if entry['address'] else "0 "
                 result += "{:#x}".format(entry['size']) if entry['size'] else "0"
                 result += ";\n"
+        yield result
         if self.root is not None:
-            result += self.root.to_dts(tabsize)
-        return result
+            yield from self.root.iter_dts(tabsize)
+
+    def write_dts(self, fileobj, tabsize: int = 4):
+        """
+        Write FDT Object in string format (DTS) into text file object without building the whole string
+
+        :param fileobj: The output file object
+        :param tabsize:
+        """
+        fileobj.writelines(self.iter_dts(tabsize))
 
     def to_dtb(self, version: int = None, last_comp_version: int = None, boot_cpuid_phys: int = None, strings: str = None) -> bytes:
         """
@@ -362,14 +654,14 @@ class FDT:
         if strings is None:
             strings = ''
 
-        blob_entries = bytes()
-        if self.entries:
-            for entry in self.entries:
-                blob_entries += pack('>QQ', entry['address'], entry['size'])
+        blob_entries = b''.join(pack('>QQ', entry['address'], entry['size']) for entry in self.entries)
         blob_entries += pack('>QQ', 0, 0)
         blob_data_start = self.header.size + len(blob_entries)
-        (blob_data, blob_strings, data_pos) = self.root.to_dtb(strings, blob_data_start, self.header.version)
-        blob_data += pack('>I', DTB_END)
+        writer = DtbWriter(strings, blob_data_start, self.header.version)
+        self.root.write_dtb(writer)
+        writer.data += pack('>I', DTB_END)
+        blob_data = writer.data
+        blob_strings = writer.strings.encode('ascii')
         self.header.size_dt_strings = len(blob_strings)
         self.header.size_dt_struct = len(blob_data)
         self.header.off_mem_rsvmap = self.header.size
@@ -377,7 +669,116 @@ class FDT:
         self.header.off_dt_strings = blob_data_start + len(blob_data)
         self.header.total_size = blob_data_start + len(blob_data) + len(blob_strings)
         blob_header = self.header.export()
-        return blob_header + blob_entries + blob_data + blob_strings.encode('ascii')
+        return b''.join((blob_header, blob_entries, blob_data, blob_strings))
+
+
+def _parse_int(value: str) -> int:
+    if value.startswith('0x'):
+        return int(value, 16)
+    elif value.startswith('0b'):
+        return int(value, 2)
+    elif value.startswith('0'):
+        return int(value, 8)
+    else:
+        return int(value)
+
+
+def _split_name(text: str) -> str:
+    """ Get node or property name from DTS statement head, labels are skipped """
+    text = text.strip()
+    if ':' not in text and ' ' not in text and '\t' not in text:
+        return text
+    words = text.replace(':', ': ').split()
+    names = [word for word in words if not word.endswith(':')]
+    return names[-1] if names else ''
+
+
+def _split_labels(text: str) -> tuple:
+    """ Get labels and node name from DTS statement head """
+    if ':' not in text:
+        return [], _split_name(text)
+    words = text.replace(':', ': ').split()
+    labels = [word[:-1] for word in words if word.endswith(':')]
+    names = [word for word in words if not word.endswith(':')]
+    return labels, names[-1] if names else ''
+
+
+def _phandle_value(node: Node):
+    """ Get phandle value of node, None if missing or if phandle and linux,phandle differ """
+    phandle = node.get_property('phandle')
+    if not isinstance(phandle, PropWords) or not isinstance(phandle.value, int):
+        return None
+    linux_phandle = node.get_property('linux,phandle')
+    if isinstance(linux_phandle, PropWords) and linux_phandle.value != phandle.value:
+        return None
+    return phandle.value
+
+
+def _ref_node(fdt_obj: FDT, ref: str):
+    """ Get node referenced as &label or &{/path}, None if missing """
+    if ref.startswith('&{') and ref.endswith('}'):
+        try:
+            return fdt_obj.get_node(ref[2:-1])
+        except ValueError:
+            return None
+    return fdt_obj.get_node_by_label(ref[1:])
+
+
+def _parse_prop_value(prop_name: str, value: str, root_dir: str, refs: list) -> Property:
+    """
+    Create property object from DTS value text
+
+    :param prop_name: Property name
+    :param value: Value text after "="
+    :param root_dir: Root directory for /incbin/ files
+    :param refs: Output list of (prop_obj, index, reference) for node references in the value
+    """
+    if value.startswith('<'):
+        prop_obj = PropWords(prop_name)
+        for token in tokenize_dts_value(value):
+            if token.startswith('<'):
+                for word in token[1:-1].split():
+                    if word.startswith('&'):
+                        # phandle, resolved when all labels are known
+                        refs.append((prop_obj, len(prop_obj), word))
+                        prop_obj.append(0)
+                    else:
+                        prop_obj.append(_parse_int(word))
+    elif value.startswith('['):
+        prop_obj = PropBytes(prop_name)
+        for token in tokenize_dts_value(value):
+            if token.startswith('['):
+                for word in token[1:-1].split():
+                    for i in range(0, len(word), 2):
+                        prop_obj.append(int(word[i:i + 2], 16))
+    elif value.startswith('/incbin/'):
+        args = [t for t in tokenize_dts_value(value)[1:] if t not in ',()']
+        if not args:
+            raise Exception("Missing /incbin/ file: {}".format(value))
+        file_path = os.path.join(root_dir, args[0].strip('"').strip())
+        file_offset = int(args[1], 0) if len(args) > 1 else 0
+        file_size = int(args[2], 0) if len(args) > 2 else 0
+        if file_path is None or not os.path.exists(file_path):
+            raise Exception("File path doesn't exist: {}".format(file_path))
+        with open(file_path, "rb") as f:
+            f.seek(file_offset)
+            prop_data = f.read(file_size) if file_size > 0 else f.read()
+        prop_obj = PropIncBin(prop_name, prop_data, os.path.split(file_path)[1])
+    elif value.startswith('/plugin/'):
+        raise NotImplementedError("Not implemented property value: /plugin/")
+    elif value.startswith('/bits/'):
+        raise NotImplementedError("Not implemented property value: /bits/")
+    else:
+        prop_obj = PropStrings(prop_name)
+        for token in tokenize_dts_value(value):
+            if token.startswith('"'):
+                prop_obj.append(token[1:-1].replace('\\"', '"'))
+            elif token != ',':
+                if token.startswith('&'):
+                    # path, resolved when all labels are known
+                    refs.append((prop_obj, len(prop_obj), token))
+                prop_obj.append(token)
+    return prop_obj
 
 
 def parse_dts(text: str, root_dir: str = '', is_only_diff: bool = False) -> FDT:
@@ -386,170 +787,319 @@ def parse_dts(text: str, root_dir: str = '', is_only_diff: bool = False) -> FDT:
 
     :param text:
     :param root_dir: 
+    :param is_only_diff: Keep property values as unparsed text (PropVariables)
     """
-    ver = get_version_info(text)
-    text = strip_comments(text)
-    dts_lines = split_to_lines(text)
     fdt_obj = FDT()
-    if 'version' in ver:
-        fdt_obj.header.version = ver['version']
-    if 'last_comp_version' in ver:
-        fdt_obj.header.last_comp_version = ver['last_comp_version']
-    if 'boot_cpuid_phys' in ver:
-        fdt_obj.header.boot_cpuid_phys = ver['boot_cpuid_phys']
-    # parse entries
-    fdt_obj.entries = []
-    for line in dts_lines:
-        if line.endswith('{'):
-            break
-        if line.startswith('/memreserve/'):
-            line = line.strip(';')
-            line = line.split()
-            if len(line) != 3 :
-                raise Exception()
-            fdt_obj.entries.append({'address': int(line[1], 0), 'size': int(line[2], 0)})
-    # parse nodes
-    curnode = None
     fdt_obj.root = None
-    for line in dts_lines:
-        if line.endswith('{'):
+    ver = {}
+    refs = []
+    phandle_nodes = []
+    stack = []
+    curnode = None
+    for end, body, skipped, line, column in tokenize_dts(text):
+        if fdt_obj.root is None and '//' in skipped:
+            # "// version: 17" lines before the root node
+            for comment in skipped.split('\n'):
+                comment = comment.strip()
+                if comment.startswith('//'):
+                    info = comment[2:].replace(':', '').split()
+                    if len(info) > 1 and info[0] in ('version', 'last_comp_version', 'boot_cpuid_phys'):
+                        ver[info[0]] = int(info[1], 0)
+
+        if end == '{':
             # start node
-            node_name = line.split()[-2]
-            new_node = Node(node_name)
-            if fdt_obj.root is None:
-                fdt_obj.root = new_node
-            if curnode is not None:
-                curnode.append(new_node)
+            labels, node_name = _split_labels(body)
+            if not node_name:
+                raise Exception("Missing node name at line {}, column {}".format(line, column))
+            if curnode is None and fdt_obj.root is not None:
+                # "/ {...};" or "&label {...};" extends existing node
+                new_node = fdt_obj.root if node_name == '/' else _ref_node(fdt_obj, node_name)
+                if new_node is None:
+                    raise Exception("Reference to undefined node \"{}\" at line {}, column {}".format(
+                        node_name, line, column))
+            elif curnode is not None and curnode.exist_subnode(node_name):
+                new_node = curnode.get_subnode(node_name)
+            else:
+                new_node = Node(node_name)
+                if fdt_obj.root is None:
+                    fdt_obj.root = new_node
+                if curnode is not None:
+                    curnode.append(new_node)
+            for label in labels:
+                fdt_obj._labels[label] = new_node
+            stack.append(new_node)
             curnode = new_node
-        elif line.endswith('}'):
+
+        elif end == '}':
             # end node
-            if curnode is not None:
-                curnode = curnode.parent
-        else:
-            # properties
-            if line.find('=') == -1:
-                prop_name = line
-                prop_obj = Property(prop_name)
-            else:
-                line = line.split('=', maxsplit=1)
-                prop_name = line[0].rstrip(' ')
-                prop_value = line[1].lstrip(' ')
+            if stack:
+                stack.pop()
+            curnode = stack[-1] if stack else None
+
+        elif not body or body.startswith('/dts-'):
+            continue
 
-                if prop_name == 'phandle' or \
-                   prop_name == 'linux,phandle':
-                   continue
+        elif not end:
+            raise Exception("Missing \";\" at line {}, column {}".format(line, column))
 
+        elif fdt_obj.root is None and body.startswith('/memreserve/'):
+            entry = body.split()
+            if len(entry) != 3:
+                raise Exception("Invalid /memreserve/ at line {}, column {}".format(line, column))
+            fdt_obj.entries.append({'address': int(entry[1], 0), 'size': int(entry[2], 0)})
+
+        elif curnode is not None:
+            # properties
+            head, eq, value = body.partition('=')
+            if not eq:
+                prop_obj = Property(' '.join(body.split()))
+            else:
+                prop_name = _split_name(head)
+                value = value.strip()
+                if not prop_name or not value:
+                    raise Exception("Invalid property at line {}, column {}".format(line, column))
+                if prop_name in PHANDLE_PROPS:
+                    if is_only_diff:
+                        # values assigned by dtc differ between compiled files
+                        continue
+                    phandle_nodes.append(curnode)
+                if '\n' in value:
+                    value = ' '.join(part.strip() for part in value.split('\n'))
                 if is_only_diff:
-                    prop_obj = PropVariables(prop_name, prop_value)
+                    prop_obj = PropVariables(prop_name, value)
                 else:
-                    if prop_value.startswith('<'):
-                        prop_obj = PropWords(prop_name)
-                        prop_value = prop_value.replace('<', '').replace('>', '')
-                        for prop in prop_value.split():
-                            if prop.startswith('0x'):
-                                prop_obj.append(int(prop, 16))
-                            elif prop.startswith('0b'):
-                                prop_obj.append(int(prop, 2))
-                            elif prop.startswith('0'):
-                                prop_obj.append(int(prop, 8))
-                            else:
-                                prop_obj.append(int(prop))
-                    elif prop_value.startswith('['):
-                        prop_obj = PropBytes(prop_name)
-                        prop_value = prop_value.replace('[', '').replace(']', '')
-                        for prop in prop_value.split():
-                            prop_obj.append(int(prop, 16))
-                    elif prop_value.startswith('/incbin/'):
-                        prop_value = prop_value.replace('/incbin/("', '').replace('")', '')
-                        prop_value = prop_value.split(',')
-                        file_path  = os.path.join(root_dir, prop_value[0].strip())
-                        file_offset = int(prop_value.strip(), 0) if len(prop_value) > 1 else 0
-                        file_size = int(prop_value.strip(), 0) if len(prop_value) > 2 else 0
-                        if file_path is None or not os.path.exists(file_path):
-                            raise Exception("File path doesn't exist: {}".format(file_path))
-                        with open(file_path, "rb") as f:
-                            f.seek(file_offset)
-                            prop_data = f.read(file_size) if file_size > 0 else f.read()
-                        prop_obj = PropIncBin(prop_name, prop_data, os.path.split(file_path)[1])
-                    elif prop_value.startswith('/plugin/'):
-                        raise NotImplementedError("Not implemented property value: /plugin/")
-                    elif prop_value.startswith('/bits/'):
-                        raise NotImplementedError("Not implemented property value: /bits/")
-                    else:
-                        prop_obj = PropStrings(prop_name)
-                        for prop in prop_value.split('",'):
-                            prop = prop.replace('"', "")
-                            prop = prop.strip()
-                            prop_obj.append(prop)
-            if curnode is not None:
-                curnode.append(prop_obj)
+                    try:
+                        prop_obj = _parse_prop_value(prop_name, value, root_dir, refs)
+                    except ValueError as e:
+                        raise ValueError("Invalid value of \"{}\" at line {}: {}".format(prop_name, line, e))
+            # a redefined property replaces the previous value
+            curnode.append(prop_obj, replace=True)
+
+    # the parsed phandles stay, only referenced nodes without phandle get a new one
+    fdt_obj._seed_phandles(phandle_nodes)
+    for prop_obj, index, ref in refs:
+        node = _ref_node(fdt_obj, ref)
+        if node is None:
+            raise Exception("Reference to undefined node \"{}\" in property \"{}\" of {}".format(
+                ref, prop_obj.name, prop_obj.path))
+        if isinstance(prop_obj, PropWords):
+            prop_obj.data[index] = fdt_obj._node_phandle(node, True, False)
+        else:
+            prop_obj.data[index] = node.node_path() or '/'
+
+    if 'version' in ver:
+        fdt_obj.header.version = ver['version']
+    if 'last_comp_version' in ver:
+        fdt_obj.header.last_comp_version = ver['last_comp_version']
+    if 'boot_cpuid_phys' in ver:
+        fdt_obj.header.boot_cpuid_phys = ver['boot_cpuid_phys']
 
     return fdt_obj
 
 
-def parse_dtb(data: bytes, offset: int = 0) -> FDT:
-    """
-    Parse FDT Binary Blob and create FDT Object
-    
-    :param data: FDT Binary Blob in bytes
-    :param offset: The offset of input data
+def _scan_dtb_struct(view, header: Header, offset: int = 0) -> list:
     """
-    assert isinstance(data, (bytes, bytearray)), "Invalid argument type"
+    Scan structure block of FDT Binary Blob without decoding property values
 
+    :param view: FDT Binary Blob as memoryview
+    :param header: Parsed header of the blob
+    :param offset: The offset of the blob in view
+    :return: Root entry as [name, [(prop_name, start, end), ...], [child_entry, ...]]
+    """
     from struct import unpack_from
 
-    fdt_obj = FDT()
-    # parse header
-    fdt_obj.header = Header.parse(data)
-    # parse entries
-    index = fdt_obj.header.off_mem_rsvmap
-    while True:
-        entrie = dict(zip(('address', 'size'), unpack_from(">QQ", data, offset + index)))
-        index += 16
-        if entrie['address'] == 0 and entrie['size'] == 0:
-            break
-        fdt_obj.entries.append(entrie)
-    # parse nodes
-    current_node = None
-    fdt_obj.root = None
-    index = fdt_obj.header.off_dt_struct
+    strings_start = offset + header.off_dt_strings
+    if header.size_dt_strings is not None:
+        strings_end = strings_start + header.size_dt_strings
+    else:
+        strings_end = offset + header.total_size
+    strings = str(view[strings_start:strings_end], 'ascii')
+    prop_names = {}
+
+    root = None
+    stack = []
+    index = header.off_dt_struct
     while True:
-        if len(data) < (offset + index + 4):
+        if len(view) < (offset + index + 4):
             raise Exception("Index out of range !")
-        tag = unpack_from(">I", data, offset + index)[0]
+        tag = unpack_from(">I", view, offset + index)[0]
         index += 4
         if tag == DTB_BEGIN_NODE:
-            node_name = extract_string(data, offset + index)
+            node_name = extract_string(view, offset + index)
             index = ((index + len(node_name) + 4) & ~3)
-            if not node_name: node_name = '/'
-            new_node = Node(node_name)
-            if fdt_obj.root is None:
-                fdt_obj.root = new_node
-            if current_node is not None:
-                current_node.append(new_node)
-            current_node = new_node
+            entry = [node_name if node_name else '/', [], []]
+            if stack:
+                stack[-1][2].append(entry)
+            elif root is None:
+                root = entry
+            stack.append(entry)
         elif tag == DTB_END_NODE:
-            if current_node is not None:
-                current_node = current_node.parent
+            if stack:
+                stack.pop()
         elif tag == DTB_PROP:
-            prop_size, prop_string_pos, = unpack_from(">II", data, offset + index)
+            prop_size, prop_string_pos, = unpack_from(">II", view, offset + index)
             prop_start = index + 8
-            if fdt_obj.header.version < 16 and prop_size >= 8:
+            if header.version < 16 and prop_size >= 8:
                 prop_start = ((prop_start + 7) & ~0x7)
-            prop_name = extract_string(data, fdt_obj.header.off_dt_strings + prop_string_pos)
-            prop_raw_value = data[offset + prop_start : offset + prop_start + prop_size]
+            prop_name = prop_names.get(prop_string_pos)
+            if prop_name is None:
+                prop_name = strings[prop_string_pos:strings.index('\0', prop_string_pos)]
+                prop_names[prop_string_pos] = prop_name
             index = prop_start + prop_size
+            if stack:
+                stack[-1][1].append((prop_name, offset + prop_start, offset + index))
             index = ((index + 3) & ~0x3)
-            if current_node is not None:
-                current_node.append(new_property(prop_name, prop_raw_value))
         elif tag == DTB_END:
             break
-        else:
+        elif tag != DTB_NOP:
             raise Exception("Unknown Tag: {}".format(tag))
 
+    return root
+
+
+def parse_dtb(data, offset: int = 0, lazy: bool = False) -> FDT:
+    """
+    Parse FDT Binary Blob and create FDT Object
+
+    Property values are read through a memoryview, so passing a memoryview or mmap object avoids copying the blob.
+
+    With lazy=True only the structure block is scanned and the nodes are created when they are accessed. The data
+    must stay valid (an mmap object open) for the lifetime of the returned object.
+
+    :param data: FDT Binary Blob as bytes, bytearray, memoryview or mmap object
+    :param offset: The offset of input data
+    :param lazy: Create nodes and properties on first access
+    """
+    assert isinstance(data, (bytes, bytearray, memoryview, mmap)), "Invalid argument type"
+
+    from struct import unpack_from
+
+    fdt_obj = FDT()
+    # parse header
+    fdt_obj.header = Header.parse(data, offset)
+    # parse entries
+    index = fdt_obj.header.off_mem_rsvmap
+    while True:
+        entrie = dict(zip(('address', 'size'), unpack_from(">QQ", data, offset + index)))
+        index += 16
+        if entrie['address'] == 0 and entrie['size'] == 0:
+            break
+        fdt_obj.entries.append(entrie)
+    if lazy:
+        view = memoryview(data)
+        entry = _scan_dtb_struct(view, fdt_obj.header, offset)
+        fdt_obj.root = None if entry is None else LazyNode(entry[0], view, entry)
+        return fdt_obj
+    # decode strings block once, names are resolved by offset
+    strings_start = offset + fdt_obj.header.off_dt_strings
+    if fdt_obj.header.size_dt_strings is not None:
+        strings_end = strings_start + fdt_obj.header.size_dt_strings
+    else:
+        strings_end = offset + fdt_obj.header.total_size
+    with memoryview(data) as view:
+        strings = str(view[strings_start:strings_end], 'ascii')
+        prop_names = {}
+        # parse nodes
+        current_node = None
+        fdt_obj.root = None
+        index = fdt_obj.header.off_dt_struct
+        while True:
+            if len(data) < (offset + index + 4):
+                raise Exception("Index out of range !")
+            tag = unpack_from(">I", data, offset + index)[0]
+            index += 4
+            if tag == DTB_BEGIN_NODE:
+                node_name = extract_string(data, offset + index)
+                index = ((index + len(node_name) + 4) & ~3)
+                if not node_name: node_name = '/'
+                new_node = Node(node_name)
+                if fdt_obj.root is None:
+                    fdt_obj.root = new_node
+                if current_node is not None:
+                    current_node.append(new_node)
+                current_node = new_node
+            elif tag == DTB_END_NODE:
+                if current_node is not None:
+                    current_node = current_node.parent
+            elif tag == DTB_PROP:
+                prop_size, prop_string_pos, = unpack_from(">II", data, offset + index)
+                prop_start = index + 8
+                if fdt_obj.header.version < 16 and prop_size >= 8:
+                    prop_start = ((prop_start + 7) & ~0x7)
+                prop_name = prop_names.get(prop_string_pos)
+                if prop_name is None:
+                    prop_name = strings[prop_string_pos:strings.index('\0', prop_string_pos)]
+                    prop_names[prop_string_pos] = prop_name
+                prop_raw_value = view[offset + prop_start : offset + prop_start + prop_size]
+                index = prop_start + prop_size
+                index = ((index + 3) & ~0x3)
+                if current_node is not None:
+                    current_node.append(new_property(prop_name, prop_raw_value))
+            elif tag == DTB_END:
+                break
+            elif tag != DTB_NOP:
+                raise Exception("Unknown Tag: {}".format(tag))
+
     return fdt_obj
 
 
+def _valid_dtb(data, offset: int, header: Header) -> bool:
+    """ Check that all blocks of blob are inside the blob and the structure block starts with a node """
+    from struct import unpack_from
+
+    total_size = header.total_size
+    if total_size < Header.MIN_SIZE or offset + total_size > len(data):
+        return False
+    if header.version < 1 or header.last_comp_version > header.version:
+        return False
+    if not (Header.MIN_SIZE <= header.off_mem_rsvmap <= total_size - 16):
+        return False
+    if not (Header.MIN_SIZE <= header.off_dt_struct <= total_size - 4):
+        return False
+    if not (Header.MIN_SIZE <= header.off_dt_strings <= total_size):
+        return False
+    if header.size_dt_strings is not None and header.off_dt_strings + header.size_dt_strings > total_size:
+        return False
+    if header.size_dt_struct is not None and header.off_dt_struct + header.size_dt_struct > total_size:
+        return False
+    index = offset + header.off_dt_struct
+    end = offset + total_size - 4
+    while index <= end:
+        tag = unpack_from(">I", data, index)[0]
+        if tag != DTB_NOP:
+            return tag == DTB_BEGIN_NODE
+        index += 4
+    return False
+
+
+def scan_dtb(data, start: int = 0, end: int = None) -> list:
+    """
+    Find all valid binary blobs in data (FIT image, boot image, concatenated DTBs) and return list of
+    (offset, Header) ordered by offset. Blobs embedded into other found blobs are included.
+
+    :param data: Image data as bytes, bytearray, memoryview or mmap object
+    :param start: The offset where scanning starts
+    :param end: The offset where scanning stops (default: end of data)
+    """
+    assert isinstance(data, (bytes, bytearray, memoryview, mmap)), "Invalid argument type"
+
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    magic = Header.MAGIC_NUMBER.to_bytes(4, 'big')
+    end = len(data) if end is None else min(end, len(data))
+    blobs = []
+    offset = data.find(magic, start, end)
+    while offset >= 0:
+        try:
+            header = Header.parse(data, offset)
+        except Exception:
+            header = None
+        if header is not None and _valid_dtb(data, offset, header):
+            blobs.append((offset, header))
+        offset = data.find(magic, offset + 1, end)
+    return blobs
+
+
 def diff(fdt1: FDT, fdt2: FDT) -> tuple:
     """ 
     Compare two flattened device tree objects and return list of 3 objects (same in 1 and 2, specific for 1, specific for 2)
@@ -593,36 +1143,45 @@ def diff(fdt1: FDT, fdt2: FDT) -> tuple:
         if not found:
             fdt_b.entries.append(entry_b)
 
-    for path, nodes, props in fdt1.walk():
-        try:
-            rnode = fdt2.get_node(path)
-        except:
-            rnode = None
-
-        for node_b in nodes:
-            if rnode is None or rnode.get_subnode(node_b.name) is None:
-                fdt_a.add_item(Node(node_b.name), path)
+    # Nodes are visited in the order of FDT.walk(). A subnode with the same content hash in both trees is copied
+    # into fdt_same as a whole and a subnode missing in the other tree is copied into fdt_a/fdt_b as a whole.
+    all_nodes = [(fdt1.root, fdt2.root)]
+    while all_nodes:
+        node_a, rnode = all_nodes.pop()
+        path = node_a.node_path() or '/'
+
+        for sub_a in node_a.nodes:
+            sub_b = rnode.get_subnode(sub_a.name)
+            if sub_b is None:
+                fdt_a.add_item(sub_a.copy(), path)
+            elif sub_a.content_hash() == sub_b.content_hash():
+                fdt_same.add_item(sub_a.copy(), path)
             else:
-                fdt_same.add_item(Node(node_b.name), path)
+                fdt_same.add_item(Node(sub_a.name), path)
+                all_nodes.append((sub_a, sub_b))
 
-        for prop_a in props:
-            if rnode is not None and prop_a == rnode.get_property(prop_a.name):
+        for prop_a in node_a.props:
+            if prop_a == rnode.get_property(prop_a.name):
                 fdt_same.add_item(prop_a.copy(), path)
             else:
                 fdt_a.add_item(prop_a.copy(), path)
 
-    for path, nodes, props in fdt2.walk():
-        try:
-            rnode = fdt_same.get_node(path)
-        except:
-            rnode = None
+    all_nodes = [(fdt2.root, fdt1.root, fdt_same.root)]
+    while all_nodes:
+        node_b, node_a, rnode = all_nodes.pop()
+        path = node_b.node_path() or '/'
 
-        for node_b in nodes:
-            if rnode is None or rnode.get_subnode(node_b.name) is None:
-                fdt_b.add_item(Node(node_b.name), path)
+        for sub_b in node_b.nodes:
+            sub_same = rnode.get_subnode(sub_b.name)
+            if sub_same is None:
+                fdt_b.add_item(sub_b.copy(), path)
+            else:
+                sub_a = node_a.get_subnode(sub_b.name)
+                if sub_a.content_hash() != sub_b.content_hash():
+                    all_nodes.append((sub_b, sub_a, sub_same))
 
-        for prop_b in props:
-            if rnode is None or prop_b != rnode.get_property(prop_b.name):
+        for prop_b in node_b.props:
+            if prop_b != rnode.get_property(prop_b.name):
                 fdt_b.add_item(prop_b.copy(), path)
 
     return fdt_same, fdt_a, fdt_b
@@ -16,8 +16,21 @@
 
 import os
 import sys
+import glob
+import mmap
+import time
 import fdt
+import fdt.cache
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from fdt.cache import ParseCache
+
+# Optional cache of parsed input files
+parse_cache = None
+
+# Total size of input files from which merge uses worker processes by default, smaller inputs are parsed faster
+# than the pool starts
+MERGE_PARALLEL_SIZE = 1024 * 1024
 
 
 ########################################################################################################################
@@ -29,6 +42,7 @@ def parse_fdt(file_path: str, file_type: str, is_only_diff: bool = False):
 
     :param file_path: The path to input file
     :param file_type: File type 'dtb', 'dts' or 'auto'
+    :param is_only_diff: Keep property values of dts file as unparsed text
     """
 
     if not os.path.exists(file_path):
@@ -43,15 +57,177 @@ def parse_fdt(file_path: str, file_type: str, is_only_diff: bool = False):
             raise Exception('Not supported file extension: {}'.format(file_path))
 
     if file_type == 'dtb':
-        with open(file_path, 'rb') as f:
-            obj = fdt.parse_dtb(f.read())
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            key = None if parse_cache is None else parse_cache.key(data, file_type)
+            obj = None if key is None else parse_cache.load(key)
+            if obj is None:
+                obj = fdt.parse_dtb(data)
+                if key is not None:
+                    parse_cache.store(key, obj)
     else:
-        with open(file_path, 'r') as f:
-            obj = fdt.parse_dts(f.read(), os.path.dirname(file_path), is_only_diff)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        key = None if parse_cache is None else parse_cache.key(data, file_type, is_only_diff)
+        obj = None if key is None else parse_cache.load(key)
+        if obj is None:
+            text = data.decode().replace('\r\n', '\n').replace('\r', '\n')
+            obj = fdt.parse_dts(text, os.path.dirname(file_path), is_only_diff)
+            if key is not None:
+                parse_cache.store(key, obj)
 
     return obj
 
 
+def merge_fdt(in_files: list, file_type: str) -> fdt.FDT:
+    """
+    Parse input files and merge them from left to right, later files replace items of former ones
+
+    :param in_files: Input Files Path
+    :param file_type: The type of input files
+    """
+    fdt_obj = None
+
+    for file in in_files:
+        obj = parse_fdt(file, file_type)
+        if fdt_obj is None:
+            fdt_obj = obj
+        else:
+            fdt_obj.merge(obj, move=True)
+
+    return fdt_obj
+
+
+def _init_worker(cache_dir, cache_size: int):
+    """ Initializer of worker processes, share the parse cache of main process """
+    global parse_cache
+    if cache_dir is not None:
+        parse_cache = ParseCache(cache_dir, cache_size)
+
+
+def _new_pool(jobs: int) -> ProcessPoolExecutor:
+    if parse_cache is None:
+        return ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=(None, 0))
+    return ProcessPoolExecutor(jobs, initializer=_init_worker,
+                               initargs=(parse_cache.cache_dir, parse_cache.max_size))
+
+
+def _merge_chunk(in_files: list, file_type: str):
+    """ Worker of merge_fdt_parallel(), return serialized headers of files and merged chunk (None if not possible) """
+    objs = [parse_fdt(file, file_type) for file in in_files]
+    heads = []
+    for obj in objs:
+        head = fdt.FDT(obj.header)
+        head.entries = [dict(entry) for entry in obj.entries]
+        heads.append(fdt.cache.dumps(head))
+    fdt_obj = objs[0]
+    for obj in objs[1:]:
+        fdt_obj.merge(obj, move=True)
+    try:
+        return heads, fdt.cache.dumps(fdt_obj)
+    except ValueError:
+        return heads, None
+
+
+def merge_fdt_parallel(in_files: list, file_type: str, jobs: int) -> fdt.FDT:
+    """
+    Parse input files in process pool and merge them in balanced tree, the result is equal to merge_fdt()
+
+    :param in_files: Input Files Path
+    :param file_type: The type of input files
+    :param jobs: Count of worker processes
+    """
+    jobs = min(jobs, len(in_files))
+    if jobs < 2:
+        return merge_fdt(in_files, file_type)
+
+    # contiguous chunks keep the order of files
+    size, rest = divmod(len(in_files), jobs)
+    chunks = []
+    start = 0
+    for index in range(jobs):
+        end = start + size + (1 if index < rest else 0)
+        chunks.append(in_files[start:end])
+        start = end
+
+    with _new_pool(jobs) as executor:
+        results = list(executor.map(_merge_chunk, chunks, [file_type] * jobs))
+
+    objs = []
+    heads = []
+    for chunk, (chunk_heads, data) in zip(chunks, results):
+        objs.append(merge_fdt(chunk, file_type) if data is None else fdt.cache.loads(data))
+        heads += [fdt.cache.loads(head) for head in chunk_heads]
+
+    # merging of nodes is associative, (a + b) + (c + d) is equal to ((a + b) + c) + d
+    while len(objs) > 1:
+        merged = []
+        for index in range(0, len(objs) - 1, 2):
+            objs[index].merge(objs[index + 1], move=True)
+            merged.append(objs[index])
+        if len(objs) % 2:
+            merged.append(objs[-1])
+        objs = merged
+
+    # merging of headers and memory reservations isn't, it's done from left to right
+    head = heads[0]
+    for obj in heads[1:]:
+        head.merge(obj)
+    objs[0].header = head.header
+    objs[0].entries = head.entries
+
+    return objs[0]
+
+
+def _parse_blob(file_path: str, offset: int, size: int):
+    """ Worker of parse_image(), return (serialized FDT object or None, error or None) """
+    try:
+        with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            blob = data[offset:offset + size]
+        key = None if parse_cache is None else parse_cache.key(blob, 'dtb')
+        obj = None if key is None else parse_cache.load(key)
+        if obj is None:
+            obj = fdt.parse_dtb(blob)
+            if key is not None:
+                parse_cache.store(key, obj)
+        return fdt.cache.dumps(obj), None
+    except Exception as e:
+        return None, str(e) if str(e) else type(e).__name__
+
+
+def parse_image(file_path: str, jobs: int = 1, errors: dict = None) -> dict:
+    """
+    Find all binary blobs in image file and parse them in process pool, return offset -> FDT object mapping
+
+    :param file_path: The path to image file (*.itb, boot image, *.dtb)
+    :param jobs: Count of worker processes
+    :param errors: If not None, offset -> error message of blobs which can't be parsed, else the error is raised
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            blobs = [(offset, header.total_size) for offset, header in fdt.scan_dtb(data)]
+
+    count = len(blobs)
+    jobs = max(1, min(jobs, count))
+    args = ([file_path] * count, [blob[0] for blob in blobs], [blob[1] for blob in blobs])
+    if jobs == 1:
+        results = list(map(_parse_blob, *args))
+    else:
+        with _new_pool(jobs) as executor:
+            results = list(executor.map(_parse_blob, *args, chunksize=max(1, count // (jobs * 4))))
+
+    fdts = {}
+    for (offset, _), (data, error) in zip(blobs, results):
+        if error is not None:
+            if errors is None:
+                raise Exception("Blob at 0x{:X}: {}".format(offset, error))
+            errors[offset] = error
+        else:
+            fdts[offset] = fdt.cache.loads(data)
+    return fdts
+
+
 ########################################################################################################################
 # Commands Functions
 ########################################################################################################################
@@ -92,12 +268,12 @@ def unpack(in_file: str, out_file: str, tab_size):
     fdt_obj = parse_fdt(in_file, 'dtb')
 
     with open(out_file, 'w') as f:
-        f.write(fdt_obj.to_dts(tab_size))
+        fdt_obj.write_dts(f, tab_size)
 
     print(" DTS saved as: {}".format(out_file))
 
 
-def merge(out_file: str, in_files: list, file_type: str, tab_size: int):
+def merge(out_file: str, in_files: list, file_type: str, tab_size: int, jobs: int = 1):
     """
     The implementation of merge command.
 
@@ -105,25 +281,24 @@ def merge(out_file: str, in_files: list, file_type: str, tab_size: int):
     :param in_files: Input Files Path
     :param file_type: The type of input files
     :param tab_size: Tabulator size in count of spaces
+    :param jobs: Count of worker processes for parsing, None for CPU count if the input files have at least
+                 MERGE_PARALLEL_SIZE bytes in total, else no workers
     """
-    fdt_obj = None
+    if jobs is None:
+        size = sum(os.path.getsize(file) for file in in_files if os.path.isfile(file))
+        jobs = (os.cpu_count() or 1) if size >= MERGE_PARALLEL_SIZE else 1
 
-    for file in in_files:
-        obj = parse_fdt(file, file_type)
-        if fdt_obj is None:
-            fdt_obj = obj
-        else:
-            fdt_obj.merge(obj)
+    fdt_obj = merge_fdt_parallel(in_files, file_type, jobs)
 
     with open(out_file, 'w') as f:
-        f.write(fdt_obj.to_dts(tab_size))
+        fdt_obj.write_dts(f, tab_size)
 
     print(" Output saved as: {}".format(out_file))
 
 
-def diff(in_file1: str, in_file2: str, file_type: str, out_dir: str):
+def save_diff(in_file1: str, in_file2: str, file_type: str, out_dir: str) -> bool:
     """
-    The implementation of diff command.
+    Compare two files and save the differences into output directory, return False if files are completely different
 
     :param in_file1: Input File1 Path
     :param in_file2: Input File2 Path
@@ -137,8 +312,7 @@ def diff(in_file1: str, in_file2: str, file_type: str, out_dir: str):
     # compare it
     diff = fdt.diff(fdt1, fdt2)
     if diff[0].empty:
-        print(" Input files are completely different !")
-        sys.exit()
+        return False
 
     # create output directory
     os.makedirs(out_dir, exist_ok=True)
@@ -153,11 +327,247 @@ def diff(in_file1: str, in_file2: str, file_type: str, out_dir: str):
     for index, obj in enumerate(diff):
         if not obj.empty:
             with open(os.path.join(out_dir, file_name[index]), 'w') as f:
-                f.write(obj.to_dts())
+                obj.write_dts(f)
+
+    return True
+
+
+def diff(in_file1: str, in_file2: str, file_type: str, out_dir: str):
+    """
+    The implementation of diff command.
+
+    :param in_file1: Input File1 Path
+    :param in_file2: Input File2 Path
+    :param file_type: The type of input files
+    :param out_dir: Path to output directory
+    """
+    if not save_diff(in_file1, in_file2, file_type, out_dir):
+        print(" Input files are completely different !")
+        sys.exit()
 
     print(" Diff output saved into: {}".format(out_dir))
 
 
+def scan(in_file: str, out_dir: str, jobs: int, tab_size: int):
+    """
+    The implementation of scan command.
+
+    :param in_file: Input Image Path
+    :param out_dir: Path to output directory for unpacked blobs or None
+    :param jobs: Count of worker processes
+    :param tab_size: Tabulator size in count of spaces
+    """
+    errors = {}
+    start = time.perf_counter()
+    fdts = parse_image(in_file, jobs, errors)
+    elapsed = time.perf_counter() - start
+
+    print(" {}: {} blobs, {} failed, {:.3f} s".format(in_file, len(fdts) + len(errors), len(errors), elapsed))
+    print(" {:<12}{:>10}{:>9}  {}".format('Offset', 'Size', 'Version', 'Model'))
+    for offset in sorted(list(fdts) + list(errors)):
+        if offset in errors:
+            print(" 0x{:<10X}{:>10}{:>9}  FAILED: {}".format(offset, '-', '-', errors[offset]))
+            continue
+        fdt_obj = fdts[offset]
+        model = '-'
+        for name in ('model', 'compatible'):
+            prop = fdt_obj.get_property(name)
+            if isinstance(prop, fdt.PropStrings) and len(prop):
+                model = prop[0]
+                break
+        print(" 0x{:<10X}{:>10}{:>9}  {}".format(offset, fdt_obj.header.total_size, fdt_obj.header.version, model))
+        if out_dir is not None:
+            os.makedirs(out_dir, exist_ok=True)
+            name = "{}-0x{:X}.dts".format(os.path.splitext(os.path.basename(in_file))[0], offset)
+            with open(os.path.join(out_dir, name), 'w') as f:
+                fdt_obj.write_dts(f, tab_size)
+
+    if out_dir is not None and fdts:
+        print(" DTS files saved into: {}".format(out_dir))
+
+    return not errors
+
+
+########################################################################################################################
+# Batch Mode
+########################################################################################################################
+
+# Phases of batch item processing
+BATCH_PHASES = ('parse', 'convert', 'write')
+
+# Extension of input and output files for batch commands
+BATCH_EXT = {
+    'pack': ('.dts', '.dtb'),
+    'unpack': ('.dtb', '.dts'),
+    'diff': (('.dts', '.dtb'), ''),
+}
+
+
+def batch_inputs(command: str, inputs: list, manifest: str = None) -> list:
+    """
+    Expand batch inputs into list of items, item is tuple of input paths (two for diff command)
+
+    :param command: Batch command 'pack', 'unpack' or 'diff'
+    :param inputs: Glob patterns, directories or files
+    :param manifest: Path to manifest file with one item per line (two paths for diff), "#" starts comment
+    """
+    in_ext = BATCH_EXT[command][0]
+    count = 2 if command == 'diff' else 1
+    items = []
+
+    if manifest is not None:
+        base_dir = os.path.dirname(manifest)
+        with open(manifest, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                paths = line.split('#', 1)[0].split()
+                if not paths:
+                    continue
+                if len(paths) != count:
+                    raise Exception("{}:{} expects {} path(s) per line".format(manifest, line_number, count))
+                items.append(tuple(os.path.join(base_dir, path) for path in paths))
+
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                files += [os.path.join(root, name) for name in sorted(names) if name.endswith(in_ext)]
+        elif os.path.exists(pattern):
+            files.append(pattern)
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True))
+            if not paths:
+                raise Exception("No input files match: {}".format(pattern))
+            files += [path for path in paths if os.path.isfile(path)]
+    if len(files) % count:
+        raise Exception("The inputs of {} command must be pairs of files".format(command))
+    items += [tuple(files[i:i + count]) for i in range(0, len(files), count)]
+
+    return items
+
+
+def batch_outputs(command: str, items: list, out_dir: str) -> list:
+    """
+    Get output path of every batch item, the directory structure of inputs is kept
+
+    :param command: Batch command 'pack', 'unpack' or 'diff'
+    :param items: Batch items
+    :param out_dir: Output directory
+    """
+    out_ext = BATCH_EXT[command][1]
+    dirs = [os.path.dirname(os.path.abspath(item[0])) for item in items]
+    common_dir = os.path.commonpath(dirs) if dirs else ''
+    outputs = []
+    for item, item_dir in zip(items, dirs):
+        name = os.path.splitext(os.path.basename(item[0]))[0]
+        if command == 'diff':
+            name += '-' + os.path.splitext(os.path.basename(item[1]))[0]
+        outputs.append(os.path.join(out_dir, os.path.relpath(item_dir, common_dir), name + out_ext))
+    return outputs
+
+
+def _batch_item(command: str, item: tuple, out_path: str, options: dict) -> tuple:
+    """
+    Process one batch item in worker, return (error or None, input bytes, output bytes, phase times)
+
+    :param command: Batch command 'pack', 'unpack' or 'diff'
+    :param item: Input paths
+    :param out_path: Output path
+    :param options: Options of the command
+    """
+    times = [0.0] * len(BATCH_PHASES)
+    in_size = out_size = 0
+    try:
+        in_size = sum(os.path.getsize(path) for path in item)
+        start = time.perf_counter()
+        if command == 'diff':
+            fdt1 = parse_fdt(item[0], options['type'], True)
+            fdt2 = parse_fdt(item[1], options['type'], True)
+        else:
+            fdt_obj = parse_fdt(item[0], 'dts' if command == 'pack' else 'dtb')
+        times[0] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if command == 'pack':
+            if options['phandles']:
+                fdt_obj.update_phandles()
+            data = [fdt_obj.to_dtb(options['version'], options['lc_version'], options['cpu_id'])]
+        elif command == 'unpack':
+            data = [fdt_obj.to_dts(options['tab_size']).encode()]
+        else:
+            diff = fdt.diff(fdt1, fdt2)
+            if diff[0].empty:
+                raise Exception("Input files are completely different")
+            names = (
+                "same.dts",
+                os.path.splitext(os.path.basename(item[0]))[0] + ".dts",
+                os.path.splitext(os.path.basename(item[1]))[0] + ".dts")
+            data = [(names[index], obj.to_dts().encode()) for index, obj in enumerate(diff) if not obj.empty]
+        times[1] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if command == 'diff':
+            os.makedirs(out_path, exist_ok=True)
+            for name, blob in data:
+                with open(os.path.join(out_path, name), 'wb') as f:
+                    f.write(blob)
+                out_size += len(blob)
+        else:
+            os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+            with open(out_path, 'wb') as f:
+                f.write(data[0])
+            out_size = len(data[0])
+        times[2] = time.perf_counter() - start
+
+    except Exception as e:
+        return str(e) if str(e) else type(e).__name__, in_size, out_size, times
+
+    return None, in_size, out_size, times
+
+
+def batch(command: str, inputs: list, manifest, out_dir: str, jobs: int, options: dict) -> bool:
+    """
+    The implementation of batch command, return True if all items succeeded.
+
+    :param command: Batch command 'pack', 'unpack' or 'diff'
+    :param inputs: Glob patterns, directories or files
+    :param manifest: Path to manifest file or None
+    :param out_dir: Output directory
+    :param jobs: Count of worker processes
+    :param options: Options of the command
+    """
+    items = batch_inputs(command, inputs, manifest)
+    if not items:
+        raise Exception("No input files")
+    outputs = batch_outputs(command, items, out_dir)
+    count = len(items)
+    jobs = max(1, min(jobs, count))
+
+    start = time.perf_counter()
+    args = ([command] * count, items, outputs, [options] * count)
+    if jobs == 1:
+        results = list(map(_batch_item, *args))
+    else:
+        with _new_pool(jobs) as executor:
+            results = list(executor.map(_batch_item, *args, chunksize=max(1, count // (jobs * 8))))
+    elapsed = time.perf_counter() - start
+
+    failed = [(item, result[0]) for item, result in zip(items, results) if result[0] is not None]
+    print(" Batch {}: {} items, {} done, {} failed, {} jobs, {:.3f} s".format(
+        command, count, count - len(failed), len(failed), jobs, elapsed))
+    print(" {:<10}{:>10}{:>16}{:>12}".format('Phase', 'Files', 'Bytes', 'Time [s]'))
+    sizes = (sum(result[1] for result in results), 0, sum(result[2] for result in results))
+    for index, phase in enumerate(BATCH_PHASES):
+        files = sum(1 for result in results if result[3][index] > 0)
+        total_time = sum(result[3][index] for result in results)
+        size = '-' if index == 1 else sizes[index]
+        print(" {:<10}{:>10}{:>16}{:>12.3f}".format(phase, files, size, total_time))
+    for item, error in failed:
+        print(" FAILED {}: {}".format(' '.join(item), error), file=sys.stderr)
+
+    return not failed
+
+
 ########################################################################################################################
 # Main
 ########################################################################################################################
@@ -167,6 +577,8 @@ def main():
         prog="pydtc",
         description="Flat Device Tree (FDT) tool for manipulation with *.dtb and *.dts files")
     parser.add_argument('-v', '--version', action='version', version=fdt.__version__)
+    parser.add_argument('--cache', dest='cache_dir', type=str, help='Directory for cache of parsed input files')
+    parser.add_argument('--cache-size', dest='cache_size', type=int, default=256, help='Cache size limit in MiB')
     subparsers = parser.add_subparsers(dest='command')
 
     # pack command
@@ -190,6 +602,9 @@ def main():
     merge_parser.add_argument('in_files', nargs='+', help='Path to input files')
     merge_parser.add_argument('-t', dest='type', type=str, choices=['auto', 'dts', 'dtb'], help='Input file type')
     merge_parser.add_argument('-s', dest='tab_size', type=int, default=4, help='Tabulator Size for dts')
+    merge_parser.add_argument('-j', dest='jobs', type=int, default=None,
+                              help='Count of worker processes (default: CPU count if the input files have 1 MiB '
+                                   'or more in total, else 1)')
 
     # diff command
     diff_parser = subparsers.add_parser('diff', help='Compare two files in *.dtb or *.dts format')
@@ -198,9 +613,37 @@ def main():
     diff_parser.add_argument('-t', dest='type', type=str, choices=['auto', 'dts', 'dtb'], help='Input file type')
     diff_parser.add_argument('-o', dest='out_dir', type=str, help='Output directory')
 
+    # scan command
+    scan_parser = subparsers.add_parser('scan', help='Find and parse all binary blobs in image (*.itb, boot image)')
+    scan_parser.add_argument('in_file', nargs=1, help='Path to image file')
+    scan_parser.add_argument('-o', dest='out_dir', type=str, help='Output directory for unpacked blobs (*.dts)')
+    scan_parser.add_argument('-j', dest='jobs', type=int, default=os.cpu_count() or 1,
+                             help='Count of worker processes (default: CPU count)')
+    scan_parser.add_argument('-s', dest='tab_size', type=int, default=4, help='Tabulator Size for dts')
+
+    # batch command
+    batch_parser = subparsers.add_parser('batch', help='Pack, unpack or diff many files in worker processes')
+    batch_parser.add_argument('batch_command', choices=['pack', 'unpack', 'diff'], help='Command for every item')
+    batch_parser.add_argument('inputs', nargs='*', help='Input files, directories or glob patterns')
+    batch_parser.add_argument('-m', dest='manifest', type=str, help='Manifest file with one item per line')
+    batch_parser.add_argument('-o', dest='out_dir', type=str, required=True, help='Output directory')
+    batch_parser.add_argument('-j', dest='jobs', type=int, default=os.cpu_count() or 1,
+                              help='Count of worker processes (default: CPU count)')
+    batch_parser.add_argument('-t', dest='type', type=str, choices=['auto', 'dts', 'dtb'], default='auto',
+                              help='Input file type for diff')
+    batch_parser.add_argument('-v', dest='version', type=int, help='DTB Version for pack')
+    batch_parser.add_argument('-l', dest='lc_version', type=int, help='DTB Last Compatible Version for pack')
+    batch_parser.add_argument('-c', dest='cpu_id', type=int, help='Boot CPU ID for pack')
+    batch_parser.add_argument('-p', dest='phandles', action='store_true', help='Update phandles for pack')
+    batch_parser.add_argument('-s', dest='tab_size', type=int, default=4, help='Tabulator Size for unpack')
+
     args = parser.parse_args()
 
     try:
+        if args.cache_dir:
+            global parse_cache
+            parse_cache = ParseCache(args.cache_dir, args.cache_size * 1024 * 1024)
+
         if args.command == 'pack':
             in_file = args.dts_file[0]
             if args.dtb_file is None:
@@ -218,12 +661,24 @@ def main():
             unpack(in_file, out_file, args.tab_size)
 
         elif args.command == 'merge':
-            merge(args.out_file[0], args.in_files, args.type, args.tab_size)
+            merge(args.out_file[0], args.in_files, args.type, args.tab_size, args.jobs)
 
         elif args.command == 'diff':
             out_dir = args.out_dir if args.out_dir else os.path.join(os.getcwd(), 'diff_out')
             diff(args.in_file1[0], args.in_file2[0], args.type, out_dir.lstrip())
 
+        elif args.command == 'scan':
+            if not scan(args.in_file[0], args.out_dir, args.jobs, args.tab_size):
+                sys.exit(1)
+
+        elif args.command == 'batch':
+            if args.version is not None and args.version > fdt.Header.MAX_VERSION:
+                raise Exception("DTB Version must be lover or equal {} !".format(fdt.Header.MAX_VERSION))
+            options = {key: getattr(args, key) for key in ('type', 'version', 'lc_version', 'cpu_id', 'phandles',
+                                                           'tab_size')}
+            if not batch(args.batch_command, args.inputs, args.manifest, args.out_dir, args.jobs, options):
+                sys.exit(1)
+
         else:
             parser.print_help()
 
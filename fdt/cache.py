@@ -0,0 +1,237 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import marshal
+from array import array
+from hashlib import blake2b
+
+from . import FDT, __version__
+from .header import Header
+from .items import WORD_TYPECODE, Property, PropStrings, PropWords, PropBytes, PropVariables, Node
+
+# Increment whenever the parser output or the cache layout changes
+CACHE_FORMAT = 3
+
+# Property kinds in cache file
+_KINDS = {Property: 0, PropStrings: 1, PropWords: 2, PropBytes: 3, PropVariables: 4}
+
+
+class _NotCacheable(ValueError):
+    pass
+
+
+########################################################################################################################
+# Tree Serialization
+########################################################################################################################
+
+def _dump_node(node: Node) -> tuple:
+    props = []
+    for prop in node.props:
+        kind = _KINDS.get(type(prop))
+        if kind is None:
+            # /incbin/ data depends on other files than the parsed one
+            raise _NotCacheable()
+        if kind == 1:
+            props.append((kind, prop.name, tuple(prop._data)))
+        elif kind == 2:
+            props.append((kind, prop.name, prop._data.tobytes()))
+        elif kind == 3:
+            props.append((kind, prop.name, bytes(prop._data)))
+        elif kind == 4:
+            props.append((kind, prop.name, prop._data))
+        else:
+            props.append((kind, prop.name, None))
+    return node.name, tuple(props), tuple(_dump_node(sub_node) for sub_node in node.nodes)
+
+
+def _load_node(entry: tuple, parent) -> Node:
+    # Items are restored without constructors, values were validated when the tree was parsed
+    name, props, nodes = entry
+    node = Node.__new__(Node)
+    node._name = name
+    node._parent = parent
+    node._hash = None
+    node._path_cache = None
+    node._path_generation = -1
+    node._items_generation = 0
+    node._copies = None
+    node._props = {}
+    for kind, prop_name, value in props:
+        if kind == 1:
+            prop = PropStrings.__new__(PropStrings)
+            prop._data = list(value)
+            prop._shared = False
+        elif kind == 2:
+            prop = PropWords.__new__(PropWords)
+            prop.word_size = 32
+            prop._data = array(WORD_TYPECODE)
+            prop._data.frombytes(value)
+            prop._shared = False
+        elif kind == 3:
+            prop = PropBytes.__new__(PropBytes)
+            prop._data = bytearray(value)
+            prop._shared = False
+        elif kind == 4:
+            prop = PropVariables.__new__(PropVariables)
+            prop._data = value
+        else:
+            prop = Property.__new__(Property)
+        prop._name = prop_name
+        prop._parent = node
+        prop._hash = None
+        node._props[prop_name] = prop
+    node._nodes = {}
+    for sub_entry in nodes:
+        node._nodes[sub_entry[0]] = _load_node(sub_entry, node)
+    return node
+
+
+def dumps(fdt_obj: FDT) -> bytes:
+    """
+    Serialize FDT object into compact binary form, raise ValueError for object with /incbin/ properties
+
+    :param fdt_obj: FDT object
+    """
+    root = None if fdt_obj.root is None else _dump_node(fdt_obj.root)
+    header = dict(vars(fdt_obj.header))
+    entries = [dict(entry) for entry in fdt_obj.entries]
+    labels = {label: fdt_obj.get_node_by_label(label).node_path() or '/'
+              for label in fdt_obj._labels if fdt_obj.get_node_by_label(label) is not None}
+    return marshal.dumps((header, entries, root, labels))
+
+
+def loads(data: bytes) -> FDT:
+    """
+    Create FDT object from data made by dumps()
+
+    :param data: Serialized FDT object
+    """
+    header_state, entries, root, labels = marshal.loads(data)
+    header = Header()
+    vars(header).update(header_state)
+    fdt_obj = FDT(header)
+    fdt_obj.entries = entries
+    fdt_obj.root = None if root is None else _load_node(root, None)
+    for label, path in labels.items():
+        fdt_obj.set_label(label, path)
+    return fdt_obj
+
+
+########################################################################################################################
+# Cache Class
+########################################################################################################################
+
+class ParseCache:
+    """Directory of parsed FDT objects with size limit, the least recently used files are removed first"""
+
+    EXT = '.fdtc'
+
+    def __init__(self, cache_dir: str, max_size: int = 256 * 1024 * 1024):
+        """
+        ParseCache constructor
+
+        :param cache_dir: Cache directory, created if missing
+        :param max_size: Size limit of all cache files in bytes
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(data, *flags) -> str:
+        """
+        Get cache key of parsed content
+
+        :param data: Input file content as bytes, bytearray, memoryview or mmap
+        :param flags: Parser arguments affecting the result
+        """
+        digest = blake2b(digest_size=20)
+        digest.update(repr((__version__, CACHE_FORMAT, marshal.version) + flags).encode())
+        digest.update(data)
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.EXT)
+
+    def load(self, key: str):
+        """
+        Get cached FDT object or None
+
+        :param key: Cache key
+        """
+        file_path = self._path(key)
+        try:
+            with open(file_path, 'rb') as f:
+                data = f.read()
+            fdt_obj = loads(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError, KeyError):
+            # damaged file
+            self._remove(file_path)
+            return None
+        try:
+            os.utime(file_path)
+        except OSError:
+            pass
+        return fdt_obj
+
+    def store(self, key: str, fdt_obj: FDT):
+        """
+        Save FDT object into cache, remove the least recently used files over the size limit
+
+        :param key: Cache key
+        :param fdt_obj: FDT object
+        """
+        try:
+            data = dumps(fdt_obj)
+        except _NotCacheable:
+            return
+        if len(data) > self.max_size:
+            return
+        file_path = self._path(key)
+        temp_path = "{}.{}.tmp".format(file_path, os.getpid())
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, file_path)
+        except OSError:
+            self._remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """ Remove the least recently used files until the cache fits into size limit """
+        files = []
+        total_size = 0
+        with os.scandir(self.cache_dir) as it:
+            for item in it:
+                if item.name.endswith(self.EXT) and item.is_file():
+                    stat = item.stat()
+                    files.append((stat.st_mtime, stat.st_size, item.path))
+                    total_size += stat.st_size
+        files.sort()
+        for _, size, file_path in files:
+            if total_size <= self.max_size:
+                break
+            self._remove(file_path)
+            total_size -= size
+
+    @staticmethod
+    def _remove(file_path: str):
+        try:
+            os.remove(file_path)
+        except OSError:
+            pass
@@ -12,13 +12,124 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
+import weakref
+from array import array
 from struct import pack, Struct
+from hashlib import blake2b
 from string import printable
 
 from .header import Header, DTB_PROP, DTB_BEGIN_NODE, DTB_END_NODE
 from .misc import is_string, line_offset
 
-BIGENDIAN_WORD = Struct(">I")
+PROP_HEADER = Struct(">III")
+PRINTABLE_CHARS = frozenset(printable)
+
+# Array type code of unsigned 32-bit word, PropWords payload is stored in native byte order
+WORD_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+SWAP_WORDS = sys.byteorder == 'little'
+
+# Incremented whenever an existing node is renamed, moved or removed. Cached node paths and
+# FDT path indexes are valid only within the generation they were built in.
+_tree_generation = 0
+
+
+def tree_generation() -> int:
+    """ Get current generation of node locations """
+    return _tree_generation
+
+
+def _touch_tree():
+    global _tree_generation
+    _tree_generation += 1
+
+
+# Every root node counts changes of items in its tree: a property or a subnode added, replaced, renamed or removed.
+# FDT search indexes are valid only within the generation of their tree they were built in, changes of other trees
+# don't invalidate them.
+def item_generation(node) -> int:
+    """
+    Get current generation of items in the tree of node
+
+    :param node: Any node of the tree
+    """
+    while node._parent is not None:
+        node = node._parent
+    return node._items_generation
+
+
+def _touch_items(node):
+    while node._parent is not None:
+        node = node._parent
+    node._items_generation += 1
+
+
+# Names of properties with node phandle value
+PHANDLE_PROPS = ('phandle', 'linux,phandle')
+
+# Log of (node, subtree) whose phandle properties were added, modified or removed (subtree=False) or which were
+# appended with all their subnodes (subtree=True). FDT phandle indexes replay the entries logged since their last
+# update. A full log is dropped and the indexes older than the dropped entries are rebuilt. Removed nodes aren't
+# logged, indexes check found nodes instead.
+PHANDLE_LOG_SIZE = 1024
+_phandle_log = []
+_phandle_log_start = 0
+
+
+def phandle_generation() -> int:
+    """ Get current generation of phandle properties (count of logged changes) """
+    return _phandle_log_start + len(_phandle_log)
+
+
+def phandle_changes(generation: int):
+    """
+    Get list of (node, subtree) logged since the generation, None if they are not all in the log anymore
+
+    :param generation: Value of phandle_generation()
+    """
+    if generation < _phandle_log_start:
+        return None
+    changes = []
+    for ref, subtree in _phandle_log[generation - _phandle_log_start:]:
+        node = ref()
+        # a dropped node is in no tree anymore
+        if node is not None:
+            changes.append((node, subtree))
+    return changes
+
+
+def _touch_phandles(node, subtree: bool = False):
+    global _phandle_log_start
+    if node is None:
+        return
+    if len(_phandle_log) >= PHANDLE_LOG_SIZE:
+        _phandle_log_start += len(_phandle_log)
+        _phandle_log.clear()
+    # the log must not keep removed nodes (and their pending copies) alive
+    _phandle_log.append((weakref.ref(node), subtree))
+
+
+# Count of nodes with not yet loaded copies (see Node.copy()). While it's zero, modifications skip looking for them.
+_shared_nodes = 0
+
+
+def _load_copies(node):
+    """ Load pending copies of node and of all its parents, they must not see the following modification """
+    chain = []
+    while node is not None:
+        chain.append(node)
+        node = node._parent
+    # loading a copy creates pending copies of subnodes, so go from the top
+    for node in reversed(chain):
+        node._release_copies()
+
+
+def _item_digest(kind: str, name: str, *chunks) -> bytes:
+    digest = blake2b(digest_size=16)
+    digest.update('{}\0{}\0'.format(kind, name).encode())
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.digest()
 
 ########################################################################################################################
 # Helper methods
@@ -29,20 +140,20 @@ def new_property(name: str, raw_value: bytes) -> object:
     Instantiate property with raw value type
 
     :param name: Property name
-    :param raw_value: Property raw data
+    :param raw_value: Property raw data as bytes, bytearray or memoryview
     """
     if is_string(raw_value):
         obj = PropStrings(name)
-        # Extract strings from raw value
-        for st in raw_value.decode('ascii').split('\0'):
-            if st:
-                obj.append(st)
+        # Extract strings from raw value, is_string() has validated all of them
+        obj._data = str(raw_value[:-1], 'ascii').split('\0')
         return obj
 
     elif len(raw_value) and len(raw_value) % 4 == 0:
         obj = PropWords(name)
         # Extract words from raw value
-        obj.data = [BIGENDIAN_WORD.unpack(raw_value[i:i + 4])[0] for i in range(0, len(raw_value), 4)]
+        obj._data.frombytes(raw_value)
+        if SWAP_WORDS:
+            obj._data.byteswap()
         return obj
 
     elif len(raw_value):
@@ -52,12 +163,87 @@ def new_property(name: str, raw_value: bytes) -> object:
         return Property(name)
 
 
+def _entry_digest(data, entry) -> bytes:
+    """ Get content hash of scanned blob node entry, equal to the hash of its decoded Node """
+    hashes = []
+    for prop_name, start, end in entry[1]:
+        raw_value = data[start:end]
+        if is_string(raw_value):
+            kind = PropStrings
+        elif len(raw_value) and len(raw_value) % 4 == 0:
+            kind = PropWords
+        elif len(raw_value):
+            kind = PropBytes
+        else:
+            kind = Property
+        hashes.append(_item_digest(kind.__name__, prop_name, raw_value))
+    for child in entry[2]:
+        hashes.append(_entry_digest(data, child))
+    return _item_digest('Node', entry[0], str(len(entry[1])).encode(), *hashes)
+
+
+class DtbWriter:
+    """Output buffer for structure block of binary blob with its strings table"""
+
+    @property
+    def pos(self):
+        """ Absolute position of the next written byte """
+        return self.start + len(self.data)
+
+    @property
+    def strings(self):
+        """ Strings table in string format """
+        return self._strings.decode('ascii')
+
+    def __init__(self, strings: str = '', pos: int = 0, version: int = Header.MAX_VERSION):
+        """
+        DtbWriter constructor
+
+        :param strings: Initial content of strings table
+        :param pos: Absolute position of the structure data
+        :param version: DTB version
+        """
+        self.data = bytearray()
+        self.start = pos
+        self.version = version
+        self._strings = bytearray()
+        self._offsets = {}
+        self._tail = ''
+        if strings:
+            self._add_strings(strings)
+
+    def _add_strings(self, text: str):
+        # Every suffix of a stored string is reusable, the first occurrence wins like str.find()
+        start = len(self._strings) - len(self._tail)
+        self._strings += text.encode('ascii')
+        chunks = (self._tail + text).split('\0')
+        self._tail = chunks.pop()
+        for chunk in chunks:
+            for i in range(len(chunk) + 1):
+                self._offsets.setdefault(chunk[i:], start + i)
+            start += len(chunk) + 1
+
+    def string_offset(self, name: str) -> int:
+        """
+        Get offset of name in strings table, append the name if missing
+
+        :param name: Property name
+        """
+        offset = self._offsets.get(name)
+        if offset is None:
+            offset = len(self._strings)
+            self._add_strings(name + '\0')
+        return offset
+
+
 ########################################################################################################################
 # Base Class
 ########################################################################################################################
 
 class BaseItem:
 
+    __slots__ = ('_name', '_parent', '_hash')
+
     @property
     def name(self):
         return self._name
@@ -68,12 +254,7 @@ class BaseItem:
 
     @property
     def path(self):
-        node = self._parent
-        path = ""
-        while node:
-            if node.name == '/': break
-            path = '/' + node.name + path
-            node = node.parent
+        path = self._parent.node_path() if self._parent is not None else ''
         return path if path else '/'
 
     def __init__(self, name: str):
@@ -83,9 +264,10 @@ class BaseItem:
         :param name: Item name
         """
         assert isinstance(name, str)
-        assert all(c in printable for c in name), "The value must contain just printable chars !"
+        assert PRINTABLE_CHARS.issuperset(name), "The value must contain just printable chars !"
         self._name = name
         self._parent = None
+        self._hash = None
 
     def __str__(self):
         """ String representation """
@@ -98,8 +280,12 @@ class BaseItem:
         :param value: The name in string format
         """
         assert isinstance(value, str)
-        assert all(c in printable for c in value), "The value must contain just printable chars !"
+        assert PRINTABLE_CHARS.issuperset(value), "The value must contain just printable chars !"
+        old_name = self._name
+        if self._parent is not None and old_name != value:
+            self._parent.rename_item(self, old_name, value)
         self._name = value
+        self._changed()
 
     def set_parent(self, value):
         """ 
@@ -110,10 +296,36 @@ class BaseItem:
         assert isinstance(value, Node)
         self._parent = value
 
+    def _before_change(self):
+        """ Must be called before this item is modified, loads shared copies of parent nodes """
+        if _shared_nodes:
+            _load_copies(self._parent)
+
+    def _changed(self):
+        """ Drop cached content hash of this item and of all its parents """
+        # a parent can keep its hash while children loaded later (LazyNode) have none, so always walk to the root
+        item = self
+        while item is not None:
+            item._hash = None
+            item = item._parent
+
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         raise NotImplementedError()
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION):
+    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION) -> tuple:
+        """
+        Get binary blob representation
+
+        :param strings: Strings table
+        :param pos: Absolute position of the item in blob
+        :param version: DTB version
+        :return: (blob, strings, pos)
+        """
+        writer = DtbWriter(strings, pos, version)
+        self.write_dtb(writer)
+        return bytes(writer.data), writer.strings, writer.pos
+
+    def write_dtb(self, writer: DtbWriter):
         raise NotImplementedError()
 
 
@@ -123,6 +335,8 @@ class BaseItem:
 
 class Property(BaseItem):
 
+    __slots__ = ()
+
     def __getitem__(self, value):
         """ Returns No Items """
         return None
@@ -135,6 +349,23 @@ class Property(BaseItem):
         """ Get object copy """
         return Property(self.name)
 
+    def content_hash(self) -> bytes:
+        """
+        Get digest of property type, name and value. The digest is cached, it's dropped by append/pop/clear
+        and whenever the data attribute is accessed (its value can be modified in place).
+        """
+        if self._hash is None:
+            self._hash = _item_digest(type(self).__name__, self.name, self._hash_data())
+        return self._hash
+
+    def _hash_data(self) -> bytes:
+        return b''
+
+    def _changed(self):
+        if self._name in PHANDLE_PROPS:
+            _touch_phandles(self._parent)
+        super()._changed()
+
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         """
         Get string representation
@@ -144,28 +375,53 @@ class Property(BaseItem):
         """
         return line_offset(tabsize, depth, '{};\n'.format(self.name))
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION):
+    def write_dtb(self, writer: DtbWriter):
         """
-        Get binary blob representation
+        Write binary blob representation
 
-        :param strings:
-        :param pos:
-        :param version:
+        :param writer: The output buffer
         """
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        pos += 12
-        return pack('>III', DTB_PROP, 0, strpos), strings, pos
+        writer.data += PROP_HEADER.pack(DTB_PROP, 0, writer.string_offset(self.name))
+
+
+class PropData(Property):
+    """Base of properties with mutable data, copies share the data until one of them is modified"""
 
+    __slots__ = ('_data', '_shared')
 
-class PropStrings(Property):
+    @property
+    def data(self):
+        # the caller can modify the data, so the content hash is dropped
+        self._before_change()
+        if self._shared:
+            self._data = self._data[:]
+            self._shared = False
+        self._changed()
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._before_change()
+        self._data = value
+        self._shared = False
+        self._changed()
+
+    def _share(self, prop):
+        """ Let the new copy prop share data (and content hash) of this property """
+        prop._data = self._data
+        prop._shared = self._shared = True
+        prop._hash = self._hash
+        return prop
+
+
+class PropStrings(PropData):
     """Property with strings as value"""
 
+    __slots__ = ()
+
     @property
     def value(self):
-        return self.data[0] if self.data else None
+        return self._data[0] if self._data else None
 
     def __init__(self, name: str, *args):
         """ 
@@ -175,47 +431,51 @@ class PropStrings(Property):
         :param args: str1, str2, ...
         """
         super().__init__(name)
-        self.data = []
+        self._data = []
+        self._shared = False
         for arg in args:
             self.append(arg)
 
     def __str__(self):
         """ String representation """
-        return "{} = {}".format(self.name, self.data)
+        return "{} = {}".format(self.name, self._data)
 
     def __len__(self):
         """ Get strings count """
-        return len(self.data)
+        return len(self._data)
 
     def __getitem__(self, index):
         """ Get string by index """
-        return self.data[index]
+        return self._data[index]
 
     def __eq__(self, obj):
         """ Check PropStrings object equality """
         if not isinstance(obj, PropStrings) or self.name != obj.name or len(self) != len(obj):
             return False
         for index in range(len(self)):
-            if self.data[index] != obj[index]:
+            if self._data[index] != obj[index]:
                 return False
         return True
 
     def copy(self):
-        """ Get object copy """
-        return PropStrings(self.name, *self.data)
+        """ Get object copy, the copy shares strings list until one of them is modified """
+        return self._share(PropStrings(self.name))
+
+    def _hash_data(self) -> bytes:
+        return ''.join(chars + '\0' for chars in self._data).encode()
 
     def append(self, value: str):
         assert isinstance(value, str)
         assert len(value) > 0, "Invalid strings value"
-        assert all(c in printable or c in ('\r', '\n') for c in value), "Invalid chars in strings value"
+        assert PRINTABLE_CHARS.issuperset(value), "Invalid chars in strings value"
         self.data.append(value)
 
     def pop(self, index: int):
-        assert 0 <= index < len(self.data), "Index out of range"
+        assert 0 <= index < len(self._data), "Index out of range"
         return self.data.pop(index)
 
     def clear(self):
-        self.data.clear()
+        self.data = []
 
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         """
@@ -226,41 +486,45 @@ class PropStrings(Property):
         """
         result  = line_offset(tabsize, depth, self.name)
         result += ' = "'
-        result += '", "'.join([item.replace('"', '\\"') for item in self.data])
+        result += '", "'.join([item.replace('"', '\\"') for item in self._data])
         result += '";\n'
         return result
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION):
+    def write_dtb(self, writer: DtbWriter):
         """
-        Get blob representation
+        Write blob representation
 
-        :param strings:
-        :param pos:
-        :param version:
+        :param writer: The output buffer
         """
-        blob = pack('')
-        for chars in self.data:
-            blob += chars.encode('ascii') + pack('b', 0)
-        blob_len = len(blob)
-        if version < 16 and (pos + 12) % 8 != 0:
-            blob = pack('b', 0) * (8 - ((pos + 12) % 8)) + blob
-        if blob_len % 4:
-            blob += pack('b', 0) * (4 - (blob_len % 4))
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob = pack('>III', DTB_PROP, blob_len, strpos) + blob
-        pos += len(blob)
-        return blob, strings, pos
+        blob = ''.join(chars + '\0' for chars in self._data).encode('ascii')
+        padding = 0
+        if writer.version < 16 and (writer.pos + 12) % 8 != 0:
+            padding = 8 - ((writer.pos + 12) % 8)
+        writer.data += PROP_HEADER.pack(DTB_PROP, len(blob), writer.string_offset(self.name))
+        writer.data += bytes(padding)
+        writer.data += blob
+        if len(blob) % 4:
+            writer.data += bytes(4 - (len(blob) % 4))
 
 
 class PropVariables(Property):
     """Property with variable as value"""
 
+    __slots__ = ('_data',)
+
     @property
     def value(self):
-        return self.data
+        return self._data
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._before_change()
+        self._data = value
+        self._changed()
 
     def __init__(self, name: str, data):
         """
@@ -270,11 +534,11 @@ class PropVariables(Property):
         :param data: Property value
         """
         super().__init__(name)
-        self.data = data
+        self._data = data
 
     def __str__(self):
         """ String representation """
-        return "{} = {}".format(self.name, self.data)
+        return "{} = {}".format(self.name, self._data)
 
     def __eq__(self, obj):
         """ Check PropVariables object equality """
@@ -284,6 +548,9 @@ class PropVariables(Property):
         """ Get object copy """
         return PropVariables(self.name, self.data)
 
+    def _hash_data(self) -> bytes:
+        return str(self.data).encode()
+
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         """
         Get string representation
@@ -298,12 +565,30 @@ class PropVariables(Property):
         return result
 
 
-class PropWords(Property):
-    """Property with words as value"""
+class PropWords(PropData):
+    """
+    Property with words as value, stored in array of unsigned 32-bit integers.
+
+    The data attribute is array('I') (not list as in older versions): it supports indexing, len(), iteration,
+    append() and slicing, but compares unequal to a list, use list(prop.data) == [...] instead. A list assigned to
+    data is converted into array.
+    """
+
+    __slots__ = ('word_size',)
 
     @property
     def value(self):
-        return self.data[0] if self.data else None
+        return self._data[0] if self._data else None
+
+    @property
+    def data(self):
+        return PropData.data.fget(self)
+
+    @data.setter
+    def data(self, value):
+        if not isinstance(value, array) or value.typecode != WORD_TYPECODE:
+            value = array(WORD_TYPECODE, value)
+        PropData.data.fset(self, value)
 
     def __init__(self, name, *args):
         """
@@ -313,22 +598,27 @@ class PropWords(Property):
         :param args: word1, word2, ...
         """
         super().__init__(name)
-        self.data = []
         self.word_size = 32
-        for val in args:
-            self.append(val)
+        self._shared = False
+        try:
+            self._data = array(WORD_TYPECODE, args)
+        except (TypeError, OverflowError):
+            # report the invalid word
+            self._data = array(WORD_TYPECODE)
+            for val in args:
+                self.append(val)
 
     def __str__(self):
         """ String representation """
-        return "{} = {}".format(self.name, self.data)
+        return "{} = {}".format(self.name, list(self._data))
 
     def __getitem__(self, index):
         """ Get word by index """
-        return self.data[index]
+        return self._data[index]
 
     def __len__(self):
         """ Get words count """
-        return len(self.data)
+        return len(self._data)
 
     def __eq__(self, prop):
         """ Check PropWords object equality  """
@@ -338,13 +628,24 @@ class PropWords(Property):
             return False
         if len(self) != len(prop):
             return False
-        for index in range(len(self)):
-            if self.data[index] != prop[index]:
-                return False
-        return True
+        return self._data == prop._data
 
     def copy(self):
-        return PropWords(self.name, *self.data)
+        """ Get object copy, the copy shares words array until one of them is modified """
+        prop = PropWords(self.name)
+        prop.word_size = self.word_size
+        return self._share(prop)
+
+    def _hash_data(self) -> bytes:
+        return self._raw_value()
+
+    def _raw_value(self) -> bytes:
+        """ Get words as big-endian bytes """
+        if not SWAP_WORDS:
+            return self._data.tobytes()
+        words = array(WORD_TYPECODE, self._data)
+        words.byteswap()
+        return words.tobytes()
 
     def append(self, value):
         assert isinstance(value, int), "Invalid object type"
@@ -353,11 +654,11 @@ class PropWords(Property):
         self.data.append(value)
 
     def pop(self, index):
-        assert 0 <= index < len(self.data), "Index out of range"
+        assert 0 <= index < len(self._data), "Index out of range"
         return self.data.pop(index)
 
     def clear(self):
-        self.data.clear()
+        self.data = array(WORD_TYPECODE)
 
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         """
@@ -368,56 +669,51 @@ class PropWords(Property):
         """
         result  = line_offset(tabsize, depth, self.name)
         result += ' = <'
-        result += ' '.join(["0x{:X}".format(word) for word in self.data])
+        result += ' '.join(["0x{:X}".format(word) for word in self._data])
         result += ">;\n"
         return result
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION):
+    def write_dtb(self, writer: DtbWriter):
         """
-        Get blob representation
+        Write blob representation
 
-        :param strings:
-        :param pos:
-        :param version:
+        :param writer: The output buffer
         """
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob = pack('>III', DTB_PROP, len(self.data) * 4, strpos)
-        blob += bytes().join([BIGENDIAN_WORD.pack(word) for word in self.data])
-        pos += len(blob)
-        return blob, strings, pos
+        writer.data += PROP_HEADER.pack(DTB_PROP, len(self._data) * 4, writer.string_offset(self.name))
+        writer.data += self._raw_value()
 
 
-class PropBytes(Property):
+class PropBytes(PropData):
     """Property with bytes as value"""
 
+    __slots__ = ()
+
     def __init__(self, name, *args, data=None):
         """ 
         PropBytes constructor
         
         :param name: Property name
         :param args: byte0, byte1, ...
-        :param data: Data as list, bytes or bytearray
+        :param data: Data as list, bytes, bytearray or memoryview
         """
         super().__init__(name)
-        self.data = bytearray(args)
+        self._data = bytearray(args)
+        self._shared = False
         if data:
-            assert isinstance(data, (list, bytes, bytearray))
-            self.data += bytearray(data)
+            assert isinstance(data, (list, bytes, bytearray, memoryview))
+            self._data += bytearray(data)
 
     def __str__(self):
         """ String representation """
-        return "{} = {}".format(self.name, self.data)
+        return "{} = {}".format(self.name, self._data)
 
     def __getitem__(self, index):
         """Get byte by index """
-        return self.data[index]
+        return self._data[index]
 
     def __len__(self):
         """ Get bytes count """
-        return len(self.data)
+        return len(self._data)
 
     def __eq__(self, prop):
         """ Check PropBytes object equality  """
@@ -428,13 +724,16 @@ class PropBytes(Property):
         if len(self) != len(prop):
             return False
         for index in range(len(self)):
-            if self.data[index] != prop[index]:
+            if self._data[index] != prop[index]:
                 return False
         return True
 
     def copy(self):
-        """ Create a copy of object """
-        return PropBytes(self.name, data=self.data)
+        """ Create a copy of object, the copy shares bytes until one of them is modified """
+        return self._share(PropBytes(self.name))
+
+    def _hash_data(self) -> bytes:
+        return bytes(self._data)
 
     def append(self, value):
         assert isinstance(value, int), "Invalid object type"
@@ -442,7 +741,7 @@ class PropBytes(Property):
         self.data.append(value)
 
     def pop(self, index):
-        assert 0 <= index < len(self.data), "Index out of range"
+        assert 0 <= index < len(self._data), "Index out of range"
         return self.data.pop(index)
 
     def clear(self):
@@ -457,33 +756,27 @@ class PropBytes(Property):
         """
         result  = line_offset(tabsize, depth, self.name)
         result += ' = ['
-        result += ' '.join(["{:02X}".format(byte) for byte in self.data])
+        result += ' '.join(["{:02X}".format(byte) for byte in self._data])
         result += '];\n'
         return result
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION):
+    def write_dtb(self, writer: DtbWriter):
         """
-        Get blob representation
+        Write blob representation
 
-        :param strings:
-        :param pos:
-        :param version:
+        :param writer: The output buffer
         """
-        strpos = strings.find(self.name + '\0')
-        if strpos < 0:
-            strpos = len(strings)
-            strings += self.name + '\0'
-        blob  = pack('>III', DTB_PROP, len(self.data), strpos)
-        blob += bytes(self.data)
-        if len(blob) % 4:
-            blob += bytes([0] * (4 - (len(blob) % 4)))
-        pos += len(blob)
-        return blob, strings, pos
+        writer.data += PROP_HEADER.pack(DTB_PROP, len(self._data), writer.string_offset(self.name))
+        writer.data += self._data
+        if len(self._data) % 4:
+            writer.data += bytes(4 - (len(self._data) % 4))
 
 
 class PropIncBin(PropBytes):
     """Property with bytes as value"""
 
+    __slots__ = ('file_name', 'relative_path')
+
     def __init__(self, name, data=None, file_name=None, rpath=None):
         """
         PropIncBin constructor
@@ -493,7 +786,7 @@ class PropIncBin(PropBytes):
         :param file_name: File name
         :param rpath: Relative path
         """
-        super().__init__(name, data)
+        super().__init__(name, data=data)
         self.file_name = file_name
         self.relative_path = rpath
 
@@ -507,13 +800,16 @@ class PropIncBin(PropBytes):
             return False
         if self.relative_path != prop.relative_path:
             return False
-        if self.data != prop.data:
+        if self._data != prop._data:
             return False
         return True
 
     def copy(self):
-        """ Create a copy of object """
-        return PropIncBin(self.name, self.data, self.file_name, self.relative_path)
+        """ Create a copy of object, the copy shares bytes until one of them is modified """
+        return self._share(PropIncBin(self.name, None, self.file_name, self.relative_path))
+
+    def _hash_data(self) -> bytes:
+        return '{}\0{}\0'.format(self.file_name, self.relative_path).encode() + bytes(self._data)
 
     def to_dts(self, tabsize: int = 4, depth: int = 0):
         """
@@ -537,17 +833,19 @@ class PropIncBin(PropBytes):
 class Node(BaseItem):
     """Node representation"""
 
+    __slots__ = ('_props', '_nodes', '_path_cache', '_path_generation', '_items_generation', '_copies', '__weakref__')
+
     @property
     def props(self):
-        return self._props
+        return list(self._props.values())
 
     @property
     def nodes(self):
-        return self._nodes
+        return list(self._nodes.values())
 
     @property
     def empty(self):
-        return False if self.nodes or self.props else True
+        return False if self._nodes or self._props else True
 
     def __init__(self, name, *args):
         """ 
@@ -557,39 +855,126 @@ class Node(BaseItem):
         :param args: List of properties and subnodes
         """
         super().__init__(name)
-        self._props = []
-        self._nodes = []
+        # name -> item maps, dict keeps the insertion order
+        self._props = {}
+        self._nodes = {}
+        self._path_cache = None
+        self._path_generation = -1
+        self._items_generation = 0
+        # id -> weak reference of not yet loaded copies sharing this node
+        self._copies = None
         for item in args:
             self.append(item)
 
     def __str__(self):
         """ String representation """
-        return "< {}: {} props, {} nodes >".format(self.name, len(self.props), len(self.nodes))
+        return "< {}: {} props, {} nodes >".format(self.name, len(self._props), len(self._nodes))
 
     def __eq__(self, node):
         """ Check node equality """
         if not isinstance(node, Node):
             return False
         if self.name != node.name or \
-           len(self.props) != len(node.props) or \
-           len(self.nodes) != len(node.nodes):
+           len(self._props) != len(node._props) or \
+           len(self._nodes) != len(node._nodes):
             return False
-        for p in self.props:
-            if p not in node.props:
+        for p in self._props.values():
+            other = node._props.get(p.name)
+            if other is None or other != p:
                 return False
-        for n in self.nodes:
-            if n not in node.nodes:
+        for n in self._nodes.values():
+            other = node._nodes.get(n.name)
+            if other is None or other != n:
                 return False
         return True
 
     def copy(self):
-        """ Create a copy of Node object """
-        node = Node(self.name)
-        for p in self.props:
-            node.append(p.copy())
-        for n in self.nodes:
-            node.append(n.copy())
-        return node
+        """
+        Create a copy of Node object. The copy shares the subtree with this node, its properties and subnodes are
+        copied (again as shared copies) on first access or before this subtree is modified.
+        """
+        return LazyNode(self.name, self)
+
+    def _add_copy(self, node):
+        global _shared_nodes
+        if self._copies is None:
+            self._copies = {}
+            _shared_nodes += 1
+        # a dropped copy unregisters itself
+        self._copies[id(node)] = weakref.ref(node, lambda ref, key=id(node): self._remove_copy(key))
+
+    def _remove_copy(self, key: int):
+        global _shared_nodes
+        if self._copies is not None:
+            self._copies.pop(key, None)
+            if not self._copies:
+                self._copies = None
+                _shared_nodes -= 1
+
+    def _release_copies(self):
+        """ Load all copies sharing this node, they don't depend on it anymore """
+        global _shared_nodes
+        if self._copies is None:
+            return
+        copies = self._copies
+        self._copies = None
+        _shared_nodes -= 1
+        for ref in copies.values():
+            node = ref()
+            if node is not None and node._source is not None:
+                node._load()
+
+    def _before_change(self):
+        """ Must be called before this node is modified, loads shared copies of this node and its parents """
+        if _shared_nodes:
+            _load_copies(self)
+
+    def content_hash(self) -> bytes:
+        """
+        Get digest of the whole subtree (node name, properties and subnodes in their order). The digest is cached
+        and dropped when the subtree is modified through Node and Property methods.
+        """
+        if self._hash is None:
+            hashes = [p.content_hash() for p in self._props.values()]
+            hashes += [n.content_hash() for n in self._nodes.values()]
+            self._hash = _item_digest('Node', self.name, str(len(self._props)).encode(), *hashes)
+        return self._hash
+
+    def set_name(self, value: str):
+        """
+        Set node name
+
+        :param value: The name in string format
+        """
+        changed = value != self.name
+        super().set_name(value)
+        if changed:
+            _touch_tree()
+            _touch_items(self)
+
+    def set_parent(self, value):
+        """
+        Set node parent
+
+        :param value: The parent node
+        """
+        if self._parent is not value and \
+           (self._parent is not None or self._path_generation == _tree_generation):
+            _touch_tree()
+        super().set_parent(value)
+
+    def node_path(self) -> str:
+        """ Get absolute path of this node (empty string for root) """
+        if self._path_generation != _tree_generation:
+            if self.name == '/':
+                path = ''
+            elif self._parent is None:
+                path = '/' + self.name
+            else:
+                path = self._parent.node_path() + '/' + self.name
+            self._path_cache = path
+            self._path_generation = _tree_generation
+        return self._path_cache
 
     def get_property(self, name):
         """ 
@@ -597,10 +982,7 @@ class Node(BaseItem):
         
         :param name: Property name
         """
-        for p in self.props:
-            if p.name == name:
-                return p
-        return None
+        return self._props.get(name)
 
     def set_property(self, name, value):
         """
@@ -609,6 +991,7 @@ class Node(BaseItem):
         :param name: Property name
         :param value: Property value
         """
+        self._before_change()
         if value is None:
             new_prop = Property(name)
         elif isinstance(value, int):
@@ -624,12 +1007,12 @@ class Node(BaseItem):
         else:
             raise TypeError('Value type not supported')
         new_prop.set_parent(self)
-        old_prop = self.get_property(name)
-        if old_prop is None:
-            self.props.append(new_prop)
-        else:
-            index = self.props.index(old_prop)
-            self.props[index] = new_prop
+        # an existing key keeps its position in the dict
+        self._props[name] = new_prop
+        _touch_items(self)
+        if name in PHANDLE_PROPS:
+            _touch_phandles(self)
+        self._changed()
 
     def get_subnode(self, name: str):
         """ 
@@ -637,10 +1020,7 @@ class Node(BaseItem):
 
         :param name: Subnode name
         """
-        for n in self.nodes:
-            if n.name == name:
-                return n
-        return None
+        return self._nodes.get(name)
 
     def exist_property(self, name: str) -> bool:
         """ 
@@ -664,9 +1044,12 @@ class Node(BaseItem):
         
         :param name: Property name
         """
-        item = self.get_property(name)
-        if item is not None:
-            self.props.remove(item)
+        self._before_change()
+        if self._props.pop(name, None) is not None:
+            _touch_items(self)
+            if name in PHANDLE_PROPS:
+                _touch_phandles(self)
+            self._changed()
 
     def remove_subnode(self, name: str):
         """ 
@@ -674,110 +1057,230 @@ class Node(BaseItem):
         
         :param name: Subnode name
         """
-        item = self.get_subnode(name)
-        if item is not None:
-            self.nodes.remove(item)
+        self._before_change()
+        if self._nodes.pop(name, None) is not None:
+            self._changed()
+            _touch_tree()
+            _touch_items(self)
 
-    def append(self, item):
+    def append(self, item, replace: bool = False):
         """ 
         Append node or property
         
         :param item: The node or property object
+        :param replace: If True, an existing item with the same name is replaced at its position
         """
         assert isinstance(item, (Node, Property)), "Invalid object type, use \"Node\" or \"Property\""
 
+        self._before_change()
         if isinstance(item, Property):
-            if self.get_property(item.name) is not None:
+            if item.name in self._props and not replace:
                 raise Exception("{}: \"{}\" property already exists".format(self, item.name))
             item.set_parent(self)
-            self.props.append(item)
+            self._props[item.name] = item
+            if item.name in PHANDLE_PROPS:
+                _touch_phandles(self)
 
         else:
-            if self.get_subnode(item.name) is not None:
-                raise Exception("{}: \"{}\" node already exists".format(self, item.name))
+            if item.name in self._nodes:
+                if not replace:
+                    raise Exception("{}: \"{}\" node already exists".format(self, item.name))
+                _touch_tree()
             if item is self:
                 raise Exception("{}: append the same node {}".format(self, item.name))
             item.set_parent(self)
-            self.nodes.append(item)
+            self._nodes[item.name] = item
+            _touch_phandles(item, True)
+        _touch_items(self)
+        self._changed()
 
-    def merge(self, node_obj, replace: bool = True):
+    def rename_item(self, item, old_name: str, new_name: str):
+        """
+        Re-key renamed property or subnode, keep its position
+
+        :param item: The node or property object
+        :param old_name: Current item name
+        :param new_name: New item name
+        """
+        items = self._props if isinstance(item, Property) else self._nodes
+        if items.get(old_name) is not item:
+            return
+        self._before_change()
+        if new_name in items:
+            raise Exception("{}: \"{}\" item already exists".format(self, new_name))
+        renamed = {}
+        for name, obj in items.items():
+            renamed[new_name if obj is item else name] = obj
+        items.clear()
+        items.update(renamed)
+        _touch_items(self)
+        if old_name in PHANDLE_PROPS or new_name in PHANDLE_PROPS:
+            _touch_phandles(self)
+        self._changed()
+
+    def merge(self, node_obj, replace: bool = True, move: bool = False):
         """ 
         Merge two nodes
         
         :param node_obj: Node object
         :param replace: If True, replace current properties with the given properties
+        :param move: If True, items of node_obj are moved instead of copied and node_obj is unusable after merge
         """
         assert isinstance(node_obj, Node), "Invalid object type"
 
-        def get_property_index(name):
-            for i, p in enumerate(self.props):
-                if p.name == name:
-                    return i
-            return None
-
-        def get_subnode_index(name):
-            for i, n in enumerate(self.nodes):
-                if n.name == name:
-                    return i
-            return None
-
         for prop in node_obj.props:
-            index = get_property_index(prop.name)
-            if index is None:
-                self.append(prop.copy())
-            elif prop in self._props:
+            old_prop = self._props.get(prop.name)
+            if old_prop is None:
+                self.append(prop if move else prop.copy())
+            elif old_prop == prop:
                 continue
             elif replace:
-                new_prop = prop.copy()
+                new_prop = prop if move else prop.copy()
+                self._before_change()
                 new_prop.set_parent(self)
-                self._props[index] = new_prop
+                self._props[prop.name] = new_prop
+                _touch_items(self)
+                if prop.name in PHANDLE_PROPS:
+                    _touch_phandles(self)
+                self._changed()
             else:
                 pass
 
         for sub_node in node_obj.nodes:
-            index = get_subnode_index(sub_node.name)
-            if index is None:
-                self.append(sub_node.copy())
-            elif sub_node in self._nodes:
+            old_node = self._nodes.get(sub_node.name)
+            if old_node is None:
+                self.append(sub_node if move else sub_node.copy())
+            elif old_node == sub_node:
                 continue
             else:
-                self._nodes[index].merge(sub_node, replace)
+                old_node.merge(sub_node, replace, move)
 
     def to_dts(self, tabsize: int = 4, depth: int = 0) -> str:
         """ 
         Get string representation of NODE object
         
+        :param tabsize: Tabulator size in count of spaces
+        :param depth: Start depth for line
+        """
+        return ''.join(self.iter_dts(tabsize, depth))
+
+    def iter_dts(self, tabsize: int = 4, depth: int = 0):
+        """
+        Generate string representation of NODE object in chunks (one per node header and its properties)
+
         :param tabsize: Tabulator size in count of spaces
         :param depth: Start depth for line
         """
         dts  = line_offset(tabsize, depth, self.name + ' {\n')
-        dts += ''.join(prop.to_dts(tabsize, depth + 1) for prop in self._props)
-        dts += ''.join(node.to_dts(tabsize, depth + 1) for node in self._nodes)
-        dts += line_offset(tabsize, depth, "};\n")
-        return dts
+        dts += ''.join(prop.to_dts(tabsize, depth + 1) for prop in self._props.values())
+        yield dts
+        for node in self._nodes.values():
+            yield from node.iter_dts(tabsize, depth + 1)
+        yield line_offset(tabsize, depth, "};\n")
 
-    def to_dtb(self, strings: str, pos: int = 0, version: int = Header.MAX_VERSION) -> tuple:
-        """ 
-        Get NODE in binary blob representation
-        
-        :param strings: 
-        :param pos:
-        :param version:
+    def write_dts(self, fileobj, tabsize: int = 4, depth: int = 0):
+        """
+        Write string representation of NODE object into text file object
+
+        :param fileobj: The output file object
+        :param tabsize: Tabulator size in count of spaces
+        :param depth: Start depth for line
+        """
+        fileobj.writelines(self.iter_dts(tabsize, depth))
+
+    def write_dtb(self, writer: DtbWriter):
+        """
+        Write NODE in binary blob representation
+
+        :param writer: The output buffer
         """
         if self.name == '/':
-            blob = pack('>II', DTB_BEGIN_NODE, 0)
+            writer.data += pack('>II', DTB_BEGIN_NODE, 0)
         else:
-            blob = pack('>I', DTB_BEGIN_NODE)
-            blob += self.name.encode('ascii') + b'\0'
-        if len(blob) % 4:
-            blob += pack('b', 0) * (4 - (len(blob) % 4))
-        pos += len(blob)
-        for prop in self._props:
-            (data, strings, pos) = prop.to_dtb(strings, pos, version)
-            blob += data
-        for node in self._nodes:
-            (data, strings, pos) = node.to_dtb(strings, pos, version)
-            blob += data
-        pos += 4
-        blob += pack('>I', DTB_END_NODE)
-        return blob, strings, pos
+            name = self.name.encode('ascii') + b'\0'
+            writer.data += pack('>I', DTB_BEGIN_NODE)
+            writer.data += name
+            if len(name) % 4:
+                writer.data += bytes(4 - (len(name) % 4))
+        for prop in self._props.values():
+            prop.write_dtb(writer)
+        for node in self._nodes.values():
+            node.write_dtb(writer)
+        writer.data += pack('>I', DTB_END_NODE)
+
+
+class LazyNode(Node):
+    """Node backed by a binary blob or by another node (see Node.copy()), items are created on first access"""
+
+    __slots__ = ('_source', '_lazy_props', '_lazy_nodes')
+
+    @property
+    def _props(self):
+        if self._source is not None:
+            self._load()
+        return self._lazy_props
+
+    @_props.setter
+    def _props(self, value):
+        self._lazy_props = value
+
+    @property
+    def _nodes(self):
+        if self._source is not None:
+            self._load()
+        return self._lazy_nodes
+
+    @_nodes.setter
+    def _nodes(self, value):
+        self._lazy_nodes = value
+
+    def __init__(self, name, data, entry=None):
+        """
+        LazyNode constructor
+
+        :param name: Node name
+        :param data: The blob as memoryview or the copied node
+        :param entry: Scanned node entry as [name, [(prop_name, start, end), ...], [child_entry, ...]] or None
+                      for copy of node
+        """
+        self._source = None
+        super().__init__(name)
+        self._source = (data, entry)
+        if entry is None:
+            data._add_copy(self)
+
+    def copy(self):
+        """ Create a copy of LazyNode object, not yet loaded node shares its blob or node """
+        if self._source is not None:
+            return LazyNode(self.name, *self._source)
+        return super().copy()
+
+    def content_hash(self) -> bytes:
+        """ Get digest of the whole subtree, not yet loaded node is hashed straight from its blob or node """
+        if self._hash is None and self._source is not None:
+            data, entry = self._source
+            if entry is None:
+                if data.name == self.name:
+                    self._hash = data.content_hash()
+            elif entry[0] == self.name:
+                self._hash = _entry_digest(data, entry)
+        return super().content_hash()
+
+    def _load(self):
+        """ Create properties and (lazy) subnodes of this node, the content and its hash don't change """
+        data, entry = self._source
+        self._source = None
+        if entry is None:
+            data._remove_copy(id(self))
+            props = [prop.copy() for prop in data._props.values()]
+            nodes = [node.copy() for node in data._nodes.values()]
+        else:
+            props = [new_property(prop_name, data[start:end]) for prop_name, start, end in entry[1]]
+            nodes = [LazyNode(child[0], data, child) for child in entry[2]]
+        for items, kind in ((props, 'property'), (nodes, 'node')):
+            loaded = self._lazy_props if kind == 'property' else self._lazy_nodes
+            for item in items:
+                if item.name in loaded:
+                    raise Exception("{}: \"{}\" {} already exists".format(self, item.name, kind))
+                item._parent = self
+                loaded[item.name] = item
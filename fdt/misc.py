@@ -16,32 +16,33 @@ import re
 from string import printable
 
 
+# printable chars allowed in strings property, NUL is the strings separator
+STRING_CHARS = bytes(c for c in printable.encode() if c not in b'\r\n')
+
+
 def is_string(data):
     """ Check property string validity """
-    if not len(data):
+    if not len(data) or data[-1] != 0 or data[0] == 0:
         return None
-    if data[-1] != 0:
+    if not isinstance(data, (bytes, bytearray)):
+        data = bytes(data)
+    if b'\0\0' in data or data.translate(None, STRING_CHARS + b'\0'):
         return None
-    pos = 0
-    while pos < len(data):
-        posi = pos
-        while pos < len(data) and \
-              data[pos] != 0 and \
-              data[pos] in printable.encode() and \
-              data[pos] not in (ord('\r'), ord('\n')):
-            pos += 1
-        if data[pos] != 0 or pos == posi:
-            return None
-        pos += 1
     return True
 
 
 def extract_string(data, offset=0):
     """ Extract string """
-    str_end = offset
-    while data[str_end] != 0:
-        str_end += 1
-    return data[offset:str_end].decode("ascii")
+    if hasattr(data, 'find'):
+        # bytes, bytearray and mmap objects
+        str_end = data.find(b'\0', offset)
+        if str_end < 0:
+            raise IndexError("String at {} is not terminated".format(offset))
+    else:
+        str_end = offset
+        while data[str_end] != 0:
+            str_end += 1
+    return str(data[offset:str_end], "ascii")
 
 
 def line_offset(tabsize, offset, string):
@@ -49,41 +50,66 @@ def line_offset(tabsize, offset, string):
     return offset + string
 
 
-def get_version_info(text):
-    ret = dict()
-    for line in text.split('\n'):
-        line = line.rstrip('\0')
-        if line and line.startswith('/ {'):
+DTS_STATEMENT = re.compile(r'''
+    (?P<skip>(?:[\s\0]|//[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/)*)
+    (?P<body>(?:(?:[^;{}"/&\s\0]|"[^"\\\n]*(?:\\.[^"\\\n]*)*"|&\{[^}]*\}|&|/(?![/*]))
+                (?:[^;{}"/&]|"[^"\\\n]*(?:\\.[^"\\\n]*)*"|&\{[^}]*\}|&|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/|//[^\n]*|/(?![/*]))*)?)
+    (?P<end>[;{}]|\Z)
+''', re.S | re.X)
+
+DTS_SPACE = re.compile(r'[\s\0]*')
+
+DTS_COMMENT = re.compile(r'("[^"\\\n]*(?:\\.[^"\\\n]*)*")|//[^\n]*|/\*[^*]*\*+(?:[^/*][^*]*\*+)*/', re.S)
+
+DTS_VALUE = re.compile(r'''
+    "[^"\\\n]*(?:\\.[^"\\\n]*)*"
+  | <[^>]*>
+  | \[[^\]]*\]
+  | &\{[^}]*\}
+  | [^\s,"<\[()]+
+  | [,()]
+''', re.S | re.X)
+
+
+def tokenize_dts(text):
+    """
+    Split DTS text into statements in a single pass
+
+    Every token is one statement terminated by ";", "{" or "}" with comments removed from its body.
+
+    :param text: DTS text
+    :return: Generator of (end, body, skipped, line, column) tuples, where end is ";", "{", "}" or "" at the end
+             of text and skipped is the whitespace and comments before the statement
+    """
+    line = 1
+    last = 0
+    pos = 0
+    while True:
+        match = DTS_STATEMENT.match(text, pos)
+        if not match:
+            pos = DTS_SPACE.match(text, pos).end()
+            line += text.count('\n', last, pos)
+            raise Exception("Unterminated string or comment in statement at line {}, column {}".format(
+                line, pos - text.rfind('\n', 0, pos)))
+        pos = match.end()
+        skip, body, end = match.groups()
+        start = match.start(2)
+        line += text.count('\n', last, start)
+        last = start
+        column = start - text.rfind('\n', 0, start)
+        if '/' in body and ('//' in body or '/*' in body):
+            body = DTS_COMMENT.sub(lambda m: m.group(1) or ' ', body)
+        body = body.strip()
+        if end or body:
+            yield end, body, skip, line, column
+        if not end:
             break
-        if line and line.startswith('//'):
-            line = line.replace('//', '').replace(':', '')
-            line = line.split()
-            if line[0] in ('version', 'last_comp_version', 'boot_cpuid_phys'):
-                ret[line[0]] = int(line[1], 0)
-    return ret
-
-
-def strip_comments(text):
-    text = re.sub('//.*?(\r\n?|\n)|/\*.*?\*/', '\n', text, flags=re.S)
-    return text
-
-
-def split_to_lines(text):
-    lines = []
-    mline = str()
-    for line in text.split('\n'):
-        line = line.replace('\t', ' ')
-        line = line.rstrip('\0')
-        line = line.rstrip(' ')
-        line = line.lstrip(' ')
-        if not line or line.startswith('/dts-'):
-            continue
-        if line.endswith('{') or line.endswith(';'):
-            line = line.replace(';', '')
-            lines.append(mline + line)
-            mline = str()
-        else:
-            mline += line
-
-    return lines
 
+
+def tokenize_dts_value(value):
+    """
+    Split DTS property value into strings, cell arrays, byte strings, words and commas
+
+    :param value: Property value text
+    """
+    return DTS_VALUE.findall(value)
@@ -0,0 +1,214 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Node queries with path patterns
+
+Pattern is a sequence of steps, every step starts with "/" (child nodes) or "//" (nodes at any depth) followed by
+node name with optional "*" and "?" wildcards and optional property conditions in square brackets:
+
+    /soc/*/i2c@*                       all i2c nodes two levels below /soc
+    //pinctrl*[compatible~=fsl]        pinctrl nodes with "fsl" in any compatible string
+    //*[status=okay][reg]              enabled nodes with reg property
+
+Conditions: [name] property exists, [name=value] property has the value (string or integer), [name~=text] some
+string of property contains the text. Values can be quoted with " or '.
+"""
+
+import re
+from fnmatch import translate
+from functools import lru_cache
+
+from .items import Node, PropStrings, PropWords, PropBytes
+
+
+_STEP = re.compile(r'(//?)([^/\[\]]*)((?:\[[^\]]*\])*)')
+_COND = re.compile(r'\[\s*([^\]=~\s]+)\s*(?:(~?=)\s*(.*?)\s*)?\]')
+
+
+########################################################################################################################
+# Conditions
+########################################################################################################################
+
+def _parse_value(text: str) -> str:
+    if len(text) > 1 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    return text
+
+
+def _int_value(text: str):
+    try:
+        return int(text, 0)
+    except ValueError:
+        return None
+
+
+def _match_value(prop, operator: str, value: str, number) -> bool:
+    if operator is None:
+        return True
+    if isinstance(prop, PropStrings):
+        if operator == '=':
+            return value in prop._data
+        for text in prop._data:
+            if value in text:
+                return True
+        return False
+    if operator == '=' and number is not None and isinstance(prop, (PropWords, PropBytes)):
+        return number in prop._data
+    return False
+
+
+########################################################################################################################
+# Query Class
+########################################################################################################################
+
+class Step:
+    """ One step of compiled path pattern """
+
+    __slots__ = ('descendant', 'name', 'match', 'conditions')
+
+    def __init__(self, descendant: bool, name: str, conditions: list):
+        """
+        Step constructor
+
+        :param descendant: Match nodes at any depth instead of child nodes only
+        :param name: Node name pattern with "*" and "?" wildcards
+        :param conditions: List of (property name, operator or None, value)
+        """
+        self.descendant = descendant
+        self.name = name or '*'
+        if '*' in self.name or '?' in self.name:
+            self.match = re.compile(translate(self.name)).match
+        else:
+            self.match = None
+        self.conditions = [(prop_name, operator, value, _int_value(value)) for prop_name, operator, value in conditions]
+
+    @property
+    def literal(self) -> bool:
+        return self.match is None
+
+    def accept(self, node: Node) -> bool:
+        """
+        Test node against step conditions
+
+        :param node: The node object
+        """
+        for name, operator, value, number in self.conditions:
+            prop = node.get_property(name)
+            if prop is None or not _match_value(prop, operator, value, number):
+                return False
+        return True
+
+
+class Query:
+    """ Compiled path pattern, can be executed on many FDT objects """
+
+    def __init__(self, pattern: str):
+        """
+        Query constructor
+
+        :param pattern: Path pattern, see module documentation
+        """
+        assert isinstance(pattern, str), "Query pattern must be a string type !"
+
+        self.pattern = pattern
+        self.steps = []
+        position = 0 if pattern != '/' else len(pattern)
+        while position < len(pattern):
+            step = _STEP.match(pattern, position)
+            if step is None or step.end() == position or (not step.group(2) and not step.group(3) and
+                                                          step.group(1) == '/'):
+                raise Exception("Invalid query pattern \"{}\" at position {}".format(pattern, position))
+            conditions = []
+            for cond in _COND.finditer(step.group(3)):
+                conditions.append((cond.group(1), cond.group(2), _parse_value(cond.group(3) or '')))
+            if len(''.join(cond.group(0) for cond in _COND.finditer(step.group(3)))) != len(step.group(3)):
+                raise Exception("Invalid query condition \"{}\" in \"{}\"".format(step.group(3), pattern))
+            self.steps.append(Step(step.group(1) == '//', step.group(2), conditions))
+            position = step.end()
+
+        # leading child steps with literal names are resolved as one path lookup
+        self.prefix = ''
+        self.first = 0
+        for step in self.steps:
+            if step.descendant or not step.literal or step.conditions:
+                break
+            self.prefix += '/' + step.name
+            self.first += 1
+        # nested contexts of "//" step can reach the same node more than once
+        self.unique = any(step.descendant for step in self.steps[self.first + 1:])
+
+    def __repr__(self):
+        return "<Query {!r}>".format(self.pattern)
+
+    def run(self, fdt_obj, path: str = ''):
+        """
+        Yield matching nodes of FDT object. Nodes are yielded in the order of FDT.search() for every step
+
+        :param fdt_obj: FDT object
+        :param path: Path of the node the pattern is relative to (default: root)
+        """
+        try:
+            start = fdt_obj.get_node((path.rstrip('/') + self.prefix) or '/')
+        except ValueError:
+            return
+        index = fdt_obj.get_search_index(build=False)
+        nodes = iter((start,))
+        for step in self.steps[self.first:]:
+            nodes = self._select(nodes, step, index)
+        if not self.unique:
+            yield from nodes
+            return
+        seen = set()
+        for node in nodes:
+            if id(node) not in seen:
+                seen.add(id(node))
+                yield node
+
+    @staticmethod
+    def _select(nodes, step: Step, index):
+        for node in nodes:
+            if not step.descendant:
+                if step.literal:
+                    sub_node = node.get_subnode(step.name)
+                    candidates = () if sub_node is None else (sub_node,)
+                else:
+                    candidates = [sub_node for sub_node in node.nodes if step.match(sub_node.name)]
+            elif index is not None:
+                names = (step.name,) if step.literal else [name for name in index.node_names if step.match(name)]
+                candidates = index.find_nodes(node, names)
+            else:
+                candidates = _sub_nodes(node, step)
+            for candidate in candidates:
+                if step.accept(candidate):
+                    yield candidate
+
+
+def _sub_nodes(node: Node, step: Step):
+    all_nodes = list(node.nodes)
+    while all_nodes:
+        node = all_nodes.pop()
+        all_nodes += node.nodes
+        if step.match(node.name) if step.match is not None else node.name == step.name:
+            yield node
+
+
+@lru_cache(maxsize=256)
+def compile_query(pattern: str) -> Query:
+    """
+    Get compiled query of path pattern, compiled queries are cached
+
+    :param pattern: Path pattern, see module documentation
+    """
+    return Query(pattern)
@@ -1,105 +1,205 @@
-import ast
-import configparser
+import io
 import os
 import re
 import subprocess
 from subprocess import PIPE
 import sys
 import tempfile
+import threading
+import time
+
+from dtscache import annotationCache
+from dtvconfig import config
+from toolchain import getToolchain
 
 def getFileName(filename: str):
     return os.path.splitext(os.path.basename(filename))[0]
 
 def loadConfig(baseDtsFile):
 
-    baseAbsPath = os.path.abspath(baseDtsFile)
-    baseRealPath = os.path.realpath(baseDtsFile)
+    # dtv.conf and existing include dirs are cached, see dtvconfig
+    return config.includeDirs(baseDtsFile)
 
-    baseDirPaths = set()
-    result_abspath = re.search('^.*(?=arch\/)', baseAbsPath)
-    result_realpath = re.search('^.*(?=arch\/)', baseRealPath)
+def includeSearchDirs(dtsFile, incIncludes):
 
-    if result_abspath:
-        baseDirPaths.add(result_abspath.group(0))
-    if result_realpath:
-        baseDirPaths.add(result_realpath.group(0))
+    # force include dir of dtsFile
+    return [os.path.dirname(dtsFile)] + list(incIncludes)
 
-    # Load configuration for the conf file
-    config = configparser.ConfigParser()
-    config.read('dtv.conf')
+def cppCommand(dtsFile, incIncludes):
 
-    # Add or remove projects from this list
-    # Only the gerrit-events of changes to projects in this list will be processed.
-    includeDirStubs =  ast.literal_eval(config.get('dtv', 'include_dir_stubs'))
+    # -H lists every included file on stderr
+    cmd = [getToolchain()['cpp'][0], '-H', '-nostdinc', '-undef', '-D__DTS__', '-x', 'assembler-with-cpp']
+    for includeDir in includeSearchDirs(dtsFile, incIncludes):
+        cmd += ['-I', includeDir]
+    cmd.append(dtsFile)
 
-    incIncludes = list()
+    return cmd
 
-    for includeDirStub in includeDirStubs:
-        for baseDirPath in baseDirPaths:
-            if os.path.exists(baseDirPath + includeDirStub):
-                incIncludes.append(baseDirPath + includeDirStub)
+def dtcCommand(incIncludes, dtsFile, level = 2, dtsShowDeletedSupport = True):
 
-    return incIncludes
+    # input is read from stdin
+    cmd = [getToolchain()['dtc'][0]]
+    for includeDir in includeSearchDirs(dtsFile, incIncludes):
+        cmd += ['-i', includeDir]
+    cmd += ['-@', '-I', 'dts', '-O', 'dts', '-f', '-s'] + ['-T'] * level + ['-o', '-']
+    if dtsShowDeletedSupport:
+        cmd.append('--comment-deleted')
 
-def annotateDTS(dtsFile, incIncludes, out_dir = None, level = 2):
+    return cmd
 
-    if out_dir:
-        if not os.path.exists(out_dir):
-            print("Path '{}' not found!".format(out_dir))
-            exit(1)
-    else:
-        out_dir = os.path.dirname(os.path.realpath(__file__))
+def drainStream(stream, lines, done = None):
 
-    # force include dir of dtsFile
-    cppIncludes = ' -I ' + os.path.dirname(dtsFile)
-    dtcIncludes = ' -i ' + os.path.dirname(dtsFile)
+    # Read stderr of a pipeline stage in background, a full pipe would block the stage
+    def drain():
+        lines.extend(stream)
+        if done:
+            done()
 
-    for includeDir in incIncludes:
-        cppIncludes += ' -I ' + includeDir
-        dtcIncludes += ' -i ' + includeDir
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    return thread
 
-    # cpp ${cpp_flags} ${cpp_includes} ${dtx} | ${DTC} ${dtc_flags} ${dtc_include} -I dts
-    try:
-        cpp = 'cpp'
-        cppFlags = ' -nostdinc -undef -D__DTS__ -x assembler-with-cpp '
-        cppResult = subprocess.run(cpp + cppIncludes + cppFlags + dtsFile,
-                                   stdout=PIPE, stderr=PIPE, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
-        print('EXCEPTION!', e)
-        print('stdout: {}'.format(e.output.decode(sys.getfilesystemencoding())))
-        print('stderr: {}'.format(e.stderr.decode(sys.getfilesystemencoding())))
-        exit(e.returncode)
+def parseIncludeTrace(dtsFile, errLines):
 
-    dtsPlugin = True if re.findall(r'\s*\/plugin\/\s*;', cppResult.stdout.decode('utf-8')) else False
-    if dtsPlugin:
-        print('DTS file is plugin')
+    # "-H" lines are dots (include depth) followed by path, other lines are real messages
+    includes = [(0, os.path.realpath(dtsFile))]
+    messages = []
+    for line in errLines:
+        result = re.match(rb'(\.+) (.*)$', line.rstrip(b'\n'))
+        if result:
+            includes.append((len(result.group(1)), os.path.realpath(os.fsdecode(result.group(2)))))
+        elif line.rstrip() != b'Multiple include guards may be useful for:' and not os.path.isfile(line.strip()):
+            messages.append(line)
 
-    dtsShowDeletedSupport = True
+    return includes, messages
+
+def runAnnotatePipeline(dtsFile, incIncludes, level, dtsShowDeletedSupport, includes, progress, processes):
+
+    # cpp ${cpp_flags} ${cpp_includes} ${dtx} | ${DTC} ${dtc_flags} ${dtc_include} -I dts
+    cppCmd = cppCommand(dtsFile, incIncludes)
+    dtcCmd = dtcCommand(incIncludes, dtsFile, level, dtsShowDeletedSupport)
+
+    progress('preprocess')
+    cpp = subprocess.Popen(cppCmd, stdout=PIPE, stderr=PIPE)
     try:
-        subprocess.run('dtc --comment-deleted -h', stdout=PIPE, stderr=PIPE, shell=True, check=True)
-    except subprocess.CalledProcessError as e:
+        dtc = subprocess.Popen(dtcCmd, stdin=cpp.stdout, stdout=PIPE, stderr=PIPE)
+    except OSError:
+        cpp.kill()
+        cpp.wait()
+        raise
+    # dtc owns the read end of the pipe now
+    cpp.stdout.close()
+    processes.extend([cpp, dtc])
+
+    cppErr = []
+    dtcErr = []
+    # cpp closes stderr when it exits, dtc has the whole input then
+    threads = [drainStream(cpp.stderr, cppErr, lambda: progress('compile')), drainStream(dtc.stderr, dtcErr)]
+
+    completed = False
+    try:
+        output = io.TextIOWrapper(dtc.stdout, encoding='utf-8')
+        # dtc writes nothing before the tree is compiled
+        line = output.readline()
+        if line:
+            progress('parse')
+            yield line
+            yield from output
+        completed = True
+    finally:
+        if not completed:
+            # reader stopped early or failed
+            for proc in (dtc, cpp):
+                if proc.poll() is None:
+                    proc.kill()
+        for proc in (dtc, cpp):
+            proc.wait()
+        for thread in threads:
+            thread.join()
+        dtc.stdout.close()
+
+    cppIncludes, cppErr = parseIncludeTrace(dtsFile, cppErr)
+    for proc, cmd, err in ((cpp, cppCmd, cppErr), (dtc, dtcCmd, dtcErr)):
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, b'', b''.join(err))
+    includes.extend(cppIncludes)
+
+# includes (optional list) gets (depth, path) of every file read by cpp when the output is complete.
+# progress (optional) is called with 'preprocess', 'compile' and 'parse' when a stage starts,
+# it can be called from another thread. processes (optional list) gets the started cpp and dtc,
+# killing them cancels the run.
+def annotateDTSLines(dtsFile, incIncludes, level = 2, useCache = True, includes = None, progress = None,
+                     processes = None):
+
+    if progress is None:
+        progress = lambda stage: None
+    if processes is None:
+        processes = []
+
+    # probed once per dtc binary
+    dtsShowDeletedSupport = getToolchain()['commentDeleted']
+    if not dtsShowDeletedSupport:
         print('WARNING!', 'dtc version doesn\'t support "comment-deleted" option')
-        dtsShowDeletedSupport = False
 
-    try:
-        dtc = 'dtc'
-        dtcFlags = ' -@ -I dts -O dts -f -s ' + (' -T ' * level) + ' -o - '
-        if dtsShowDeletedSupport:
-            dtcFlags += '--comment-deleted '
-        dtcResult = subprocess.run(dtc + dtcIncludes + dtcFlags,
-                                   stdout=PIPE, stderr=PIPE, input=cppResult.stdout, shell=True, check=True)
+    cache = None
+    if useCache:
+        try:
+            cache = annotationCache()
+            cacheKey = cache.key(dtsFile, incIncludes, level, dtsShowDeletedSupport)
+            cached = cache.load(cacheKey)
+        except OSError as e:
+            print('WARNING!', 'annotation cache disabled:', e)
+            cache = None
+            cached = None
+
+    if cache and cached:
+        # nothing changed since the last run, skip cpp and dtc
+        source, cppIncludes = cached
+        progress('parse')
+    else:
+        cppIncludes = []
+        startTime = time.time_ns()
+        source = runAnnotatePipeline(dtsFile, incIncludes, level, dtsShowDeletedSupport, cppIncludes, progress,
+                                     processes)
+
+    lines = []
+    dtsPlugin = False
+    for line in source:
+        if not dtsPlugin and re.match(r'\s*\/plugin\/\s*;', line):
+            dtsPlugin = True
+            print('DTS file is plugin')
+        if cache and not cached:
+            lines.append(line)
+        yield line
+
+    if cache and not cached:
+        cache.store(cacheKey, lines, cppIncludes, startTime, includeSearchDirs(dtsFile, incIncludes))
+
+    if includes is not None:
+        includes.extend(cppIncludes)
 
-    except subprocess.CalledProcessError as e:
-        print('EXCEPTION!', e)
-        print('stdout: {}'.format(e.output.decode(sys.getfilesystemencoding())))
-        print('stderr: {}'.format(e.stderr.decode(sys.getfilesystemencoding())))
-        exit(e.returncode)
+def annotateDTS(dtsFile, incIncludes, out_dir = None, level = 2):
+
+    if out_dir:
+        if not os.path.exists(out_dir):
+            print("Path '{}' not found!".format(out_dir))
+            exit(1)
+    else:
+        out_dir = os.path.dirname(os.path.realpath(__file__))
 
     # Create a temporary file in the current working directory
     (tmpAnnotatedFile, tmpAnnotatedFileName) = tempfile.mkstemp(dir=out_dir,
                                                                 prefix=getFileName(dtsFile) + '-annotated-',
                                                                 suffix='.dts')
-    with os.fdopen(tmpAnnotatedFile, 'w') as output:
-        output.write(dtcResult.stdout.decode('utf-8') )
+    try:
+        with os.fdopen(tmpAnnotatedFile, 'w') as output:
+            # merged inputs are new temporary files, their output is never reused
+            output.writelines(annotateDTSLines(dtsFile, incIncludes, level, useCache=False))
+    except subprocess.CalledProcessError as e:
+        os.remove(tmpAnnotatedFileName)
+        print('EXCEPTION!', e)
+        print('stdout: {}'.format(e.output.decode(sys.getfilesystemencoding())))
+        print('stderr: {}'.format(e.stderr.decode(sys.getfilesystemencoding())))
+        exit(e.returncode)
 
     return tmpAnnotatedFileName
@@ -128,9 +128,26 @@ class includeTree(object):
         for node in self.children:
             node.printChildrenFilePaths(level + 1)
 
-    def __init__(self, topFile, includeDirs, includeMacros=([])):
+    def __init__(self, topFile, includeDirs, includeMacros=([]), scan=True):
         self.file = os.path.realpath(topFile)
         self.includeDirs = includeDirs
         self.children = []
-        self.findIncludedFiles(includeDirs, includeMacros)
+        if scan:
+            self.findIncludedFiles(includeDirs, includeMacros)
+
+# Build the tree from the files read by cpp, without re-reading them.
+# includes is a list of (depth, path) as reported by "cpp -H", depth 0 is the top file.
+def includeTreeFromTrace(includes):
+
+    parents = []
+    for depth, path in includes:
+        node = includeTree(path, [], scan=False)
+
+        # cpp enters one level at a time, the parent is the last file one level up
+        del parents[depth:]
+        if parents:
+            parents[-1].addChild(node)
+        parents.append(node)
+
+    return parents[0] if parents else None
 
@@ -0,0 +1,88 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fdt
+
+DTS = """/dts-v1/;
+/ {
+    a {
+        b {
+            x = <0x1>;
+        };
+    };
+};
+"""
+
+
+def _eager():
+    fdt_obj = fdt.parse_dts(DTS)
+    fdt_obj.header.version = 17
+    return fdt_obj
+
+
+def _diff_dts(fdt_a, fdt_b):
+    return [fdt_obj.get_node('a/b').to_dts() for fdt_obj in fdt.diff(fdt_a, fdt_b)]
+
+
+def _diff_mutate_diff(fdt_obj, base):
+    # the first diff caches content hashes, the second one must see the change below them
+    fdt.diff(fdt_obj, base)
+    fdt_obj.get_node('a/b').get_property('x').append(2)
+    return _diff_dts(fdt_obj, base)
+
+
+def test_diff_after_change_of_eager_tree():
+    base = _eager()
+    result = _diff_mutate_diff(fdt.parse_dtb(base.to_dtb()), base)
+    assert 'x = <0x1 0x2>;' in result[1]
+    assert 'x = <0x1>;' in result[2]
+
+
+def test_diff_after_change_of_lazy_tree():
+    base = _eager()
+    blob = base.to_dtb()
+    expected = _diff_mutate_diff(fdt.parse_dtb(blob), base)
+    assert _diff_mutate_diff(fdt.parse_dtb(blob, lazy=True), base) == expected
+
+
+def test_diff_after_change_of_copied_tree():
+    base = _eager()
+    expected = _diff_mutate_diff(fdt.parse_dtb(base.to_dtb()), base)
+    copied = fdt.FDT()
+    copied.root = base.root.copy()
+    assert _diff_mutate_diff(copied, base) == expected
+    # the source of the copy is not changed
+    assert list(base.get_node('a/b').get_property('x').data) == [1]
+
+
+def test_diff_after_change_through_data():
+    base = _eager()
+    fdt_obj = fdt.parse_dtb(base.to_dtb())
+    fdt.diff(fdt_obj, base)
+    fdt_obj.get_node('a/b').get_property('x').data[0] = 7
+    result = _diff_dts(fdt_obj, base)
+    assert 'x = <0x7>;' in result[1]
+    assert 'x = <0x1>;' in result[2]
+
+
+def test_diff_after_assignment_of_variable():
+    base = _eager()
+    base.get_node('a/b').append(fdt.PropVariables('v', 'A'))
+    copied = fdt.FDT()
+    copied.root = base.root.copy()
+    fdt.diff(copied, base)
+    copied.get_node('a/b').get_property('v').data = 'B'
+    result = _diff_dts(copied, base)
+    assert 'v = B;' in result[1]
+    assert 'v = A;' in result[2]
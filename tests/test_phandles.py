@@ -0,0 +1,65 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fdt
+
+DTS = """/dts-v1/;
+/ {
+    a: a {
+        phandle = <0x5>;
+    };
+    b: b {
+    };
+    c {
+        ref = <&a &b 0x5>;
+        path = &b;
+    };
+};
+"""
+
+
+def test_parse_keeps_phandles():
+    fdt_obj = fdt.parse_dts(DTS)
+    assert fdt_obj.get_property('phandle', 'a').data[0] == 5
+    assert fdt_obj.get_property('linux,phandle', 'a') is None
+    # only the referenced node without phandle gets a new one, after the highest parsed value
+    assert fdt_obj.get_property('phandle', 'b').data[0] == 6
+    assert fdt_obj.get_property('linux,phandle', 'b') is None
+    assert list(fdt_obj.get_property('ref', 'c').data) == [5, 6, 5]
+    assert fdt_obj.get_node_by_phandle(5) is fdt_obj.get_node('a')
+    assert fdt_obj.get_node_by_phandle(6) is fdt_obj.get_node('b')
+
+
+def test_phandle_index_follows_changes():
+    fdt_obj = fdt.parse_dts(DTS)
+    node = fdt.Node('d', fdt.PropWords('phandle', 9))
+    fdt_obj.root.append(node)
+    assert fdt_obj.get_node_by_phandle(9) is node
+    node.set_property('phandle', 10)
+    assert fdt_obj.get_node_by_phandle(9) is None
+    assert fdt_obj.get_node_by_phandle(10) is node
+    fdt_obj.root.remove_subnode('d')
+    assert fdt_obj.get_node_by_phandle(10) is None
+    fdt_obj.get_node('a').remove_property('phandle')
+    assert fdt_obj.get_node_by_phandle(5) is None
+    assert fdt_obj.get_phandle('c', True) == 7
+
+
+def test_phandle_index_ignores_other_trees():
+    fdt_obj = fdt.parse_dts(DTS)
+    other = fdt.parse_dts(DTS)
+    assert fdt_obj.get_node_by_phandle(5) is fdt_obj.get_node('a')
+    other.root.append(fdt.Node('d', fdt.PropWords('phandle', 20)))
+    assert fdt_obj.get_node_by_phandle(20) is None
+    assert fdt_obj.get_phandle('c', True) == 7
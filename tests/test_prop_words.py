@@ -0,0 +1,27 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fdt
+
+
+def test_str_shows_list():
+    assert str(fdt.PropWords('x', 1, 2)) == 'x = [1, 2]'
+
+
+def test_data_is_word_array():
+    prop = fdt.PropWords('x', 1, 2)
+    assert list(prop.data) == [1, 2]
+    prop.data = [3, 4]
+    assert list(prop.data) == [3, 4]
+    assert prop.to_dtb('')[0][12:] == bytes.fromhex('0000000300000004')
@@ -0,0 +1,45 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import fdt
+
+
+def _tree(count):
+    fdt_obj = fdt.FDT()
+    for i in range(count):
+        fdt_obj.add_item(fdt.Node('n{}'.format(i)))
+        fdt_obj.set_property('p', [i], 'n{}'.format(i))
+    return fdt_obj
+
+
+def test_index_kept_while_other_tree_changes():
+    fdt_a = _tree(3)
+    fdt_b = _tree(3)
+    index = fdt_a.get_search_index()
+    fdt_b.set_property('q', [1], 'n0')
+    fdt_b.get_node('n1').set_name('r1')
+    fdt_b.root.remove_subnode('n2')
+    assert fdt_a.get_search_index() is index
+    assert len(fdt_a.search('p', fdt.ItemType.PROP)) == 3
+
+
+def test_index_updated_after_own_changes():
+    fdt_obj = _tree(3)
+    fdt_obj.get_search_index()
+    fdt_obj.set_property('q', [1], 'n0')
+    assert len(fdt_obj.search('q')) == 1
+    fdt_obj.get_node('n1').set_name('r1')
+    assert fdt_obj.search('n1') == [] and len(fdt_obj.search('r1')) == 1
+    fdt_obj.root.remove_subnode('n2')
+    assert len(fdt_obj.search('p', fdt.ItemType.PROP)) == 2
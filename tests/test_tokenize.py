@@ -0,0 +1,38 @@
+# Copyright 2017 Martin Olejar
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+
+import pytest
+
+from fdt.misc import tokenize_dts
+
+
+@pytest.mark.parametrize('text', [
+    'a = x y x y x y x y "unterminated;',
+    'a = ' + 'x y ' * 5000 + '"unterminated;',
+    'a = ' + '"s" ' * 5000 + '/* unterminated;',
+    ' ' * 20000 + '"unterminated',
+])
+def test_unterminated_fails_fast(text):
+    start = time.perf_counter()
+    with pytest.raises(Exception, match='Unterminated string or comment'):
+        list(tokenize_dts('/ {\n' + text + '\n};\n'))
+    assert time.perf_counter() - start < 1
+
+
+def test_statements():
+    text = '/ { // c\n a = "x;" /* ; */ , &{/n} ;\n};'
+    assert [token[:2] for token in tokenize_dts(text)] == [
+        ('{', '/'), (';', 'a = "x;"   , &{/n}'), ('}', ''), (';', '')]
@@ -0,0 +1,87 @@
+import json
+import os
+import shutil
+import subprocess
+from subprocess import PIPE
+
+# dtc options probed with "dtc <option> -h"
+DTC_OPTIONS = ['--annotate', '--comment-deleted']
+
+# Increment whenever the layout of the cache file changes
+CACHE_FORMAT = 2
+
+tools = None
+
+def dtvCacheDir():
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'dtv')
+
+# Return [path, real path, mtime, size] of binary found in PATH or None.
+# The path is run as found, tools like ccache or busybox pick their mode from argv[0].
+# A rebuilt or replaced binary gets a new identity.
+def toolIdentity(name):
+    path = shutil.which(name)
+    if not path:
+        return None
+    realPath = os.path.realpath(path)
+    stat = os.stat(realPath)
+    return [path, realPath, stat.st_mtime_ns, stat.st_size]
+
+def probeDtcOptions(dtcPath):
+    options = {}
+    for option in DTC_OPTIONS:
+        result = subprocess.run([dtcPath, option, '-h'], stdout=PIPE, stderr=PIPE)
+        options[option] = result.returncode == 0
+    return options
+
+def loadProbeCache(cacheFile):
+    try:
+        with open(cacheFile) as f:
+            probes = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return probes if isinstance(probes, dict) else {}
+
+def storeProbeCache(cacheFile, probes):
+    tmpCacheFile = '{}.{}.tmp'.format(cacheFile, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cacheFile), exist_ok=True)
+        with open(tmpCacheFile, 'w') as f:
+            json.dump(probes, f)
+        os.replace(tmpCacheFile, cacheFile)
+    except OSError:
+        try:
+            os.remove(tmpCacheFile)
+        except OSError:
+            pass
+
+# Resolve cpp and dtc and probe dtc options once per process.
+# Probe results are kept on disk for every dtc in PATH, valid while its real path, mtime and size are the same.
+def getToolchain():
+    global tools
+    if tools is not None:
+        return tools
+
+    cpp = toolIdentity('cpp')
+    dtc = toolIdentity('dtc')
+    options = dict.fromkeys(DTC_OPTIONS, False)
+
+    if dtc:
+        cacheFile = os.path.join(dtvCacheDir(), 'toolchain.json')
+        probes = loadProbeCache(cacheFile)
+        probe = probes.get(dtc[0])
+        probeKey = [CACHE_FORMAT, DTC_OPTIONS] + dtc[1:]
+        if isinstance(probe, dict) and probe.get('key') == probeKey:
+            options = probe['options']
+        else:
+            options = probeDtcOptions(dtc[0])
+            probes[dtc[0]] = {'key': probeKey, 'options': options}
+            storeProbeCache(cacheFile, probes)
+
+    tools = {
+        'cpp': cpp,
+        'dtc': dtc,
+        'annotate': options.get('--annotate', False),
+        'commentDeleted': options.get('--comment-deleted', False),
+    }
+    return tools